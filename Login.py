@@ -1,33 +1,23 @@
 # Login.py
 
-import bcrypt  # For password hashing
-import gspread
-import pandas as pd
 import streamlit as st
-from oauth2client.service_account import ServiceAccountCredentials
+
+from utils import auth, prefetch
+from utils.tenants import get_tenants
 
 # Set page layout to centered
 st.set_page_config(layout="centered")
 
-# Access secrets from Streamlit
-credentials_dict = st.secrets["google_api"]
+# Function to check if login credentials are correct
+def is_login_valid(username, password, tenant):
+    # The hash comes from the school's cached username index and bcrypt runs on a worker pool
+    login = auth.verify_login(username, password, tenant)
 
-# Use the dictionary directly with gspread
-credentials = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict)
-client = gspread.authorize(credentials)
+    # Meanwhile start downloading the school's worksheets, so the first page finds
+    # them already cached. Anonymous visits and browsing the school list load nothing.
+    prefetch.start(tenant)
 
-# Open your Google Sheet for user information
-user_sheet = client.open("Entry_Form").worksheet("Users_HGH")
-users_data = pd.DataFrame(user_sheet.get_all_records())
-
-# Function to check if login credentials are correct
-def is_login_valid(username, password):
-    user_record = users_data[users_data['username'] == username]
-    if not user_record.empty:
-        stored_password_hash = user_record.iloc[0]['password'].encode('utf-8')  # Get the hashed password
-        # Check the entered password against the stored hashed password
-        return bcrypt.checkpw(password.encode('utf-8'), stored_password_hash)
-    return False
+    return login.result()
 
 # Initialize session state for login
 if 'logged_in' not in st.session_state:
@@ -37,21 +27,28 @@ if 'username' not in st.session_state:
     st.session_state['username'] = ""
 
 # Hide sidebar if not logged in
-if not st.session_state['logged_in']:
+if not auth.is_logged_in():
     st.sidebar.empty()  # Hide the sidebar
 
     # Login Section
     st.title("Login")
 
+    # Each school has its own worksheets; with only one school there is nothing to choose
+    tenants = get_tenants()
+    if len(tenants) > 1:
+        login_tenant = st.selectbox("School", list(tenants), format_func=lambda code: tenants[code].name, key="login_tenant")
+    else:
+        login_tenant = next(iter(tenants))
+
     # Login fields
     login_username = st.text_input("Username", key="login_username")
     login_password = st.text_input("Password", type="password", key="login_password")
 
     # Login button
     if st.button("Login"):
-        if is_login_valid(login_username, login_password):
-            st.session_state['logged_in'] = True
-            st.session_state['username'] = login_username
+        if is_login_valid(login_username, login_password, login_tenant):
+            # Store a signed session token so pages don't re-verify the user
+            auth.log_in(login_username, login_tenant)
             st.success("Logged in successfully!")
 
             # Redirect to 1_Load.py by setting query params
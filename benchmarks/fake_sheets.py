@@ -0,0 +1,123 @@
+# fake_sheets.py
+
+import random
+import threading
+import time
+
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+from utils import sheets
+
+
+# Just enough of a requests.Response for gspread's APIError
+class QuotaResponse:
+    status_code = 429
+    text = "Quota exceeded"
+
+    def json(self):
+        return {"error": {"code": 429, "message": "Quota exceeded for quota metric 'Write requests'", "status": "RESOURCE_EXHAUSTED"}}
+
+
+class Cell:
+
+    def __init__(self, row, col, value=None):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+# In-memory stand-in for the gspread Worksheet calls utils/sheets.py makes.
+# Every call waits latency seconds, full downloads another row_latency seconds
+# per 1000 rows. A quota_error_rate share of writes fails with a 429 APIError;
+# reads never fail, since the app retries rate-limited writes but not reads.
+class FakeWorksheet:
+
+    def __init__(self, title, rows, latency=0.0, row_latency=0.0, quota_error_rate=0.0, seed=None):
+        self.title = title
+        self.latency = latency
+        self.row_latency = row_latency
+        self.quota_error_rate = quota_error_rate
+        self._rows = [[str(value) for value in row] for row in rows]
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def _wait(self, rows=0):
+        time.sleep(self.latency + self.row_latency * rows / 1000)
+
+    def _write(self):
+        self._wait()
+        with self._lock:
+            failed = self._random.random() < self.quota_error_rate
+        if failed:
+            raise APIError(QuotaResponse())
+
+    def get_all_values(self):
+        with self._lock:
+            rows = [list(row) for row in self._rows]
+        self._wait(len(rows))
+        return rows
+
+    def append_rows(self, values, table_range=None, **kwargs):
+        self._write()
+        with self._lock:
+            first = len(self._rows) + 1
+            self._rows.extend([str(value) for value in row] for row in values)
+            last = len(self._rows)
+        width = max((len(row) for row in values), default=1)
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:{rowcol_to_a1(last, width)}"}}
+
+    def batch_update(self, data, **kwargs):
+        self._write()
+        with self._lock:
+            for item in data:
+                row, col = a1_to_rowcol(item["range"])
+                cells = self._rows[row - 1]
+                for offset, value in enumerate(item["values"][0]):
+                    cells.extend([""] * (col + offset - len(cells)))
+                    cells[col - 1 + offset] = str(value)
+
+    def delete_rows(self, start_index, end_index=None):
+        self._write()
+        with self._lock:
+            del self._rows[start_index - 1:end_index or start_index]
+
+    def find(self, query, in_column=None, **kwargs):
+        self._wait()
+        with self._lock:
+            for number, row in enumerate(self._rows, start=1):
+                for col, value in enumerate(row, start=1):
+                    if value == query and in_column in (None, col):
+                        return Cell(number, col, value)
+        return None
+
+    def cell(self, row, col, **kwargs):
+        self._wait()
+        with self._lock:
+            cells = self._rows[row - 1] if row <= len(self._rows) else []
+            return Cell(row, col, cells[col - 1] if col <= len(cells) else None)
+
+
+class FakeSpreadsheet:
+
+    def __init__(self, worksheets):
+        self._worksheets = {worksheet.title: worksheet for worksheet in worksheets}
+
+    def worksheet(self, name):
+        if name not in self._worksheets:
+            raise WorksheetNotFound(name)
+        return self._worksheets[name]
+
+
+class FakeClient:
+
+    def __init__(self, spreadsheets):
+        self._spreadsheets = spreadsheets
+
+    def open(self, name):
+        return self._spreadsheets[name]
+
+
+# Serve every worksheet the app opens from the fake client instead of Google
+def install(client):
+    sheets.get_client = lambda: client
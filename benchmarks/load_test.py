@@ -0,0 +1,471 @@
+# load_test.py
+#
+# Load test of the whole app: many simulated users log in and work through the
+# Load, Table, Filter and Dashboard pages at the same time, driven by Streamlit's
+# AppTest against an in-memory stand-in for Google Sheets (fake_sheets.py) that
+# adds latency and rate-limit errors. Each roster size runs in its own process so
+# caches and memory figures do not carry over.
+#
+# Reports, per roster size and action, the p50 / p95 rerun latency under load and
+# the Sheets API calls the action makes, plus memory per session. Exits with
+# status 1 when a figure breaks the thresholds file, or with --baseline grows by
+# more than --tolerance over an earlier report.
+#
+# thresholds.json holds max_errors (failed visits), max_memory_per_session_mb,
+# and per action max_p95_ms and max_calls (Sheets calls with warm caches), with
+# "*" for actions not listed. Its latencies were set at about twice what the
+# defaults measured on a development machine; re-measure on the hosting you size.
+#
+# It patches Streamlit internals and so only runs on the Streamlit releases in
+# TESTED_STREAMLIT. Run from the repository root, e.g.
+#   python benchmarks/load_test.py
+#   python benchmarks/load_test.py --sizes 1000 10000 50000 --sessions 20 --report report.json
+#   python benchmarks/load_test.py --report new.json --baseline report.json
+
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import bcrypt
+import numpy as np
+import pandas as pd
+import streamlit
+
+# The harness patches Streamlit internals (AppTest's Runtime and PagesManager, the
+# script runner's ScriptCache), which change between minor releases. Refuse to run
+# on a release outside the tested range rather than measure something else.
+TESTED_STREAMLIT = ((1, 65), (1, 65))
+if not TESTED_STREAMLIT[0] <= tuple(int(part) for part in streamlit.__version__.split(".")[:2]) <= TESTED_STREAMLIT[1]:
+    sys.exit(
+        f"load_test.py is tested with Streamlit {'.'.join(map(str, TESTED_STREAMLIT[0]))} to "
+        f"{'.'.join(map(str, TESTED_STREAMLIT[1]))}.x, found {streamlit.__version__}; "
+        "check the patched internals and widen TESTED_STREAMLIT"
+    )
+
+from streamlit import config  # noqa: E402
+from streamlit.runtime import Runtime  # noqa: E402
+from streamlit.runtime.pages_manager import PagesManager  # noqa: E402
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache  # noqa: E402
+from streamlit.testing.v1 import AppTest, app_test, local_script_runner  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+# The app's modules, imported the way its pages import them
+sys.path[:0] = [ROOT, BENCH_DIR]
+import fake_sheets  # noqa: E402
+from utils import bulk_import, data, tracing  # noqa: E402
+from utils.sheets import SPREADSHEET_NAME  # noqa: E402
+from utils.tenants import get_tenant  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+DEFAULT_SESSIONS = 20
+DEFAULT_ROUNDS = 2
+DEFAULT_THRESHOLDS = os.path.join(BENCH_DIR, "thresholds.json")
+
+# Sheets API round trip, and extra download time per 1000 rows, in seconds
+DEFAULT_LATENCY = 0.05
+DEFAULT_ROW_LATENCY = 0.02
+
+# Share of writes answered with 429
+DEFAULT_QUOTA_ERROR_RATE = 0.02
+
+# Sessions kept open while measuring memory per session
+MEMORY_SESSIONS = 5
+
+# Production bcrypt cost, so logins cost what they do on the server
+DEFAULT_BCRYPT_ROUNDS = 12
+PASSWORD = "benchmark"
+
+# Longest a single rerun may take before AppTest gives up, in seconds
+RUN_TIMEOUT = 120
+
+# p95 changes smaller than this are noise, whatever the tolerance, in ms
+NOISE_MS = 20
+
+MB = 1024 * 1024
+
+# Every action of one visit, in order
+ACTIONS = [
+    "login.open", "login.submit",
+    "load.open", "load.create",
+    "table.open", "table.choose_action", "table.search", "table.update",
+    "filter.open", "filter.apply",
+    "dashboard.open",
+]
+
+# The app's entry point and the pages a visit goes through
+PAGES = ["Login.py", "pages/1_Load.py", "pages/2_Table.py", "pages/3_Filter.py", "pages/4_Dashboard.py"]
+
+SYLLABLES = ["an", "be", "ca", "de", "el", "fi", "ge", "ha", "jo", "ka", "le", "ma", "ne", "ol", "pi", "ra", "si", "te", "un", "vo", "wi", "za"]
+OPTIONS = ["Opsie A", "Opsie B", "Opsie C"]
+
+
+# Valid 13-digit ID number i: birth dates spread over four years, a sequence
+# number per date and the Luhn check digit
+def synthetic_id(i):
+    born = date(2008, 1, 1) + timedelta(days=i % 1460)
+    body = [int(digit) for digit in f"{born:%y%m%d}{i // 1460:04d}08"]
+    doubled = [digit * 2 - 9 if digit * 2 > 9 else digit * 2 for digit in body[1::2]]
+    return "".join(map(str, body)) + str(-(sum(body[0::2]) + sum(doubled)) % 10)
+
+
+def synthetic_name(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+
+
+# A roster as the Students worksheet holds it, header row first, run through the
+# app's own import checks so the derived columns are exactly what it computes
+def synthetic_roster(size, seed):
+    rng = random.Random(seed)
+    upload = [
+        {
+            "studid": synthetic_id(i),
+            "name": synthetic_name(rng),
+            "midlename": synthetic_name(rng) if rng.random() < 0.3 else "",
+            "surname": synthetic_name(rng),
+            "school": rng.choice(OPTIONS),
+            "maths": str(rng.randint(30, 100)),
+            "english": str(rng.randint(30, 100)),
+            "afrikaans": str(rng.randint(30, 100)),
+            "siblings": rng.choice(["Yes", "No"]),
+            "sport": rng.choice(OPTIONS),
+            "culture": rng.choice(OPTIONS),
+            "leader": rng.choice(OPTIONS),
+        }
+        for i in range(size)
+    ]
+    records, _ = bulk_import.prepare_import(pd.DataFrame(upload), [], {})
+    return [bulk_import.RECORD_COLUMNS] + records.astype(str).values.tolist()
+
+
+# Secrets of the app under test: replica in memory and no trace log, so the
+# run leaves nothing behind
+SECRETS = """
+[replica]
+path = ":memory:"
+
+[tracing]
+log_path = ""
+"""
+
+
+# AppTest runs one app at a time: each run sets up process-wide state (a mock
+# runtime, the pages-directory flag, app-testing mode, a fresh bytecode cache)
+# and clears it when done, pulling it from under any session running at the
+# same moment. For concurrent sessions that state is set once and kept: the
+# classes below pass values on to the real class and ignore resets to None.
+class _Kept(type):
+
+    def __setattr__(cls, name, value):
+        if value is not None:
+            setattr(cls.__mro__[1], name, value)
+
+
+class KeptRuntime(Runtime, metaclass=_Kept):
+    pass
+
+
+class KeptPagesManager(PagesManager, metaclass=_Kept):
+    pass
+
+
+def share_runtime():
+    # Compiled up front: compiling on several threads at once can fail in CPython
+    script_cache = ScriptCache()
+    for path in PAGES:
+        script_cache.get_bytecode(os.path.join(ROOT, path))
+    app_test.Runtime = KeptRuntime
+    app_test.PagesManager = KeptPagesManager
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+    config.set_option("global.appTest", True)
+
+
+# Numbers visits, so each creates its own student and updates a different one
+_visits = itertools.count()
+
+
+def _widget(at, kind, label):
+    for element in getattr(at, kind):
+        if element.label.startswith(label):
+            return element
+    shown = [element.value for element in at.title] + [element.value for element in at.warning] + [element.value for element in at.error]
+    raise LookupError(f"No {kind} labelled {label!r}, the page shows {shown}")
+
+
+# Rerun an app, recording how long it took and the Sheets calls made meanwhile.
+# Calls are only attributable to the action while a single session runs.
+def _timed(results, action, at):
+    meter = tracing.get_meter()
+    before = dict(meter.totals)
+    start = time.perf_counter()
+    at.run()
+    elapsed = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise RuntimeError(f"{action}: {at.exception[0].value}")
+    results.append((action, elapsed, {kind: meter.totals[kind] - before[kind] for kind in before}))
+
+
+# A write that was not confirmed (a conflict, a failed save) fails the visit
+def _confirmed(action, at):
+    if not at.success:
+        raise RuntimeError(f"{action}: {at.error[0].value if at.error else 'no confirmation shown'}")
+
+
+# One user's visit: log in, create a student, find and update another one,
+# filter the roster and open the dashboard. Returns the user's session.
+def visit(user, number, roster, results):
+    rng = random.Random(f"{user}-{number}")
+    count = next(_visits)
+
+    at = AppTest.from_file(os.path.join(ROOT, PAGES[0]), default_timeout=RUN_TIMEOUT)
+    _timed(results, "login.open", at)
+    at.text_input(key="login_username").input(user)
+    at.text_input(key="login_password").input(PASSWORD)
+    _widget(at, "button", "Login").click()
+    _timed(results, "login.submit", at)
+    if not at.session_state["logged_in"]:
+        raise RuntimeError(f"login.submit: {user} was not logged in")
+
+    at.switch_page("pages/1_Load.py")
+    _timed(results, "load.open", at)
+    _widget(at, "text_input", "Student ID").input(synthetic_id(len(roster) + count))
+    _widget(at, "text_input", "Student Name").input(synthetic_name(rng))
+    _widget(at, "text_input", "Student Surname").input(synthetic_name(rng))
+    _widget(at, "button", "Create Student").click()
+    _timed(results, "load.create", at)
+    _confirmed("load.create", at)
+
+    at.switch_page("pages/2_Table.py")
+    _timed(results, "table.open", at)
+    _widget(at, "selectbox", "Select Action").select("Update")
+    _timed(results, "table.choose_action", at)
+    student = roster[1 + count % (len(roster) - 1)]
+    _widget(at, "text_input", "Find the student").input(f"{student[1]} {student[3]}")
+    _timed(results, "table.search", at)
+    _widget(at, "number_input", "Mathematics Average").set_value(rng.randint(30, 100))
+    _widget(at, "button", "Update Record").click()
+    _timed(results, "table.update", at)
+    _confirmed("table.update", at)
+
+    at.switch_page("pages/3_Filter.py")
+    _timed(results, "filter.open", at)
+    _widget(at, "multiselect", "Select Primary School(s)").select(rng.choice(OPTIONS))
+    _timed(results, "filter.apply", at)
+
+    at.switch_page("pages/4_Dashboard.py")
+    _timed(results, "dashboard.open", at)
+    return at
+
+
+def _percentiles(samples):
+    p50, p95 = np.percentile(samples, [50, 95]) if samples else (0.0, 0.0)
+    return round(float(p50), 1), round(float(p95), 1)
+
+
+# Benchmark one roster size in this process, working in workdir
+def run_size(size, args, workdir):
+    # Streamlit reads secrets from the working directory
+    os.makedirs(os.path.join(workdir, ".streamlit"))
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as file:
+        file.write(SECRETS)
+    os.chdir(workdir)
+    share_runtime()
+
+    tenant = get_tenant()
+    users = [f"user{number:03d}" for number in range(args.sessions)]
+    password_hash = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(args.bcrypt_rounds)).decode("utf-8")
+    roster = synthetic_roster(size, args.seed)
+
+    def worksheet(title, rows):
+        return fake_sheets.FakeWorksheet(title, rows, args.latency, args.row_latency, args.quota_error_rate, args.seed)
+
+    fake_sheets.install(fake_sheets.FakeClient({SPREADSHEET_NAME: fake_sheets.FakeSpreadsheet([
+        worksheet(tenant.students_sheet, roster),
+        worksheet(tenant.users_sheet, [["username", "password"]] + [[user, password_hash] for user in users]),
+    ])}))
+
+    # Sheets calls per action: one visit on cold caches, then one on warm caches
+    cold, warm = [], []
+    visit(users[0], "cold", roster, cold)
+    visit(users[0], "warm", roster, warm)
+
+    # Latency: every user's visits at the same time
+    results, errors = [], []
+
+    def user_visits(user):
+        for number in range(args.rounds):
+            try:
+                visit(user, number, roster, results)
+            except Exception as error:
+                errors.append(f"{user}: {error}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        list(pool.map(user_visits, users))
+    duration = time.perf_counter() - started
+
+    # Memory: what a few more sessions, kept open, add on top of the shared caches
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [visit(users[number % len(users)], f"memory {number}", roster, []) for number in range(MEMORY_SESSIONS)]
+    per_session = (tracemalloc.get_traced_memory()[0] - before) / len(kept)
+    tracemalloc.stop()
+
+    actions = {}
+    for action in ACTIONS:
+        samples = [elapsed for name, elapsed, _ in results if name == action]
+        p50, p95 = _percentiles(samples)
+        actions[action] = {
+            "runs": len(samples),
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "calls_cold": next((calls for name, _, calls in cold if name == action), {}),
+            "calls": next((calls for name, _, calls in warm if name == action), {}),
+        }
+    p50, p95 = _percentiles([elapsed for _, elapsed, _ in results])
+
+    return {
+        "students": size,
+        "sessions": args.sessions,
+        "actions": actions,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "actions_per_second": round(len(results) / duration, 2),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "memory_per_session_mb": round(per_session / MB, 2),
+        "shared_cache_mb": round(sum(data.get_tenant_caches().usage().values()) / MB, 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "api_calls": dict(tracing.get_meter().totals),
+    }
+
+
+def _limit(limits, action):
+    if isinstance(limits, dict):
+        return limits.get(action, limits.get("*"))
+    return limits
+
+
+# Figures over the limits of the thresholds file
+def check_thresholds(report, thresholds):
+    failures = []
+    for size, result in report["sizes"].items():
+        prefix = f"{size} students"
+        if result["errors"] > thresholds.get("max_errors", 0):
+            failures.append(f"{prefix}: {result['errors']} failed visits, e.g. {result['error_samples'][:1]}")
+        limit = thresholds.get("max_memory_per_session_mb")
+        if limit is not None and result["memory_per_session_mb"] > limit:
+            failures.append(f"{prefix}: {result['memory_per_session_mb']} MB per session, limit {limit} MB")
+        for action, stats in result["actions"].items():
+            limit = _limit(thresholds.get("max_p95_ms"), action)
+            if limit is not None and stats["p95_ms"] > limit:
+                failures.append(f"{prefix}, {action}: p95 {stats['p95_ms']} ms, limit {limit} ms")
+            limit = _limit(thresholds.get("max_calls"), action)
+            if limit is not None and sum(stats["calls"].values()) > limit:
+                failures.append(f"{prefix}, {action}: {sum(stats['calls'].values())} Sheets calls, limit {limit}")
+    return failures
+
+
+# Figures that got worse than in an earlier report of the same sizes. Sheets
+# calls do not vary between runs, so any increase counts.
+def check_baseline(report, baseline, tolerance):
+    failures = []
+    for size, result in report["sizes"].items():
+        previous = baseline["sizes"].get(size)
+        if previous is None:
+            continue
+        prefix = f"{size} students"
+        if result["memory_per_session_mb"] > previous["memory_per_session_mb"] * (1 + tolerance):
+            failures.append(f"{prefix}: {result['memory_per_session_mb']} MB per session, was {previous['memory_per_session_mb']} MB")
+        for action, stats in result["actions"].items():
+            old = previous["actions"].get(action)
+            if old is None:
+                continue
+            if stats["p95_ms"] > max(old["p95_ms"] * (1 + tolerance), old["p95_ms"] + NOISE_MS):
+                failures.append(f"{prefix}, {action}: p95 {stats['p95_ms']} ms, was {old['p95_ms']} ms")
+            if sum(stats["calls"].values()) > sum(old["calls"].values()):
+                failures.append(f"{prefix}, {action}: {sum(stats['calls'].values())} Sheets calls, was {sum(old['calls'].values())}")
+    return failures
+
+
+def print_report(report):
+    for size, result in report["sizes"].items():
+        print(f"\n{size} students, {result['sessions']} concurrent sessions: "
+              f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, {result['actions_per_second']} actions/s, "
+              f"{result['memory_per_session_mb']} MB per session, {result['shared_cache_mb']} MB shared cache, "
+              f"{result['max_rss_mb']} MB peak RSS, {result['errors']} errors")
+        print(f"  {'action':<22}{'p50 ms':>10}{'p95 ms':>10}{'reads':>8}{'writes':>8}{'cold reads':>12}")
+        for action, stats in result["actions"].items():
+            print(f"  {action:<22}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+                  f"{stats['calls'].get('read', 0):>8}{stats['calls'].get('write', 0):>8}{stats['calls_cold'].get('read', 0):>12}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the app against a fake Google Sheet.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="roster sizes to test")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS, help="concurrent users")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="visits per user")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="seconds per Sheets call")
+    parser.add_argument("--row-latency", type=float, default=DEFAULT_ROW_LATENCY, help="extra seconds per 1000 rows downloaded")
+    parser.add_argument("--quota-error-rate", type=float, default=DEFAULT_QUOTA_ERROR_RATE, help="share of writes failing with 429")
+    parser.add_argument("--bcrypt-rounds", type=int, default=DEFAULT_BCRYPT_ROUNDS)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS, help="JSON file of limits; empty to skip")
+    parser.add_argument("--baseline", help="earlier --report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed growth over the baseline")
+    parser.add_argument("--report", help="write the report as JSON to this file")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # A single size runs in this (child) process
+    if args.size is not None:
+        with tempfile.TemporaryDirectory(prefix="studentload-bench-") as workdir:
+            result = run_size(args.size, args, workdir)
+        print(json.dumps(result))
+        return 0
+
+    report = {"settings": {key: value for key, value in vars(args).items() if key != "size"}, "sizes": {}}
+    for size in args.sizes:
+        print(f"Testing {size} students...", file=sys.stderr)
+        command = [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--size", str(size)]
+        child = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        if child.returncode != 0:
+            print(f"The run with {size} students failed", file=sys.stderr)
+            return 1
+        report["sizes"][str(size)] = json.loads(child.stdout.strip().splitlines()[-1])
+
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    failures = []
+    if args.thresholds:
+        with open(args.thresholds, encoding="utf-8") as file:
+            failures += check_thresholds(report, json.load(file))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            failures += check_baseline(report, json.load(file), args.tolerance)
+
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
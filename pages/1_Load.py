@@ -1,13 +1,15 @@
 # Load.py
 
-from datetime import datetime
-
-import gspread
-import pandas as pd
 import streamlit as st
-from oauth2client.service_account import ServiceAccountCredentials
 
-if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
+from utils import auth, bulk_import, data, ranking, tracing
+from utils.derived import points_for
+from utils.student_id import parse_id
+
+# Time the stages of this run for the performance log
+tracing.start_page("1_Load")
+
+if not auth.is_logged_in():
     # Redirect to Login page if not logged in
     st.title("Please log in first")
 else:
@@ -15,22 +17,8 @@ else:
     # Set page layout to centered (default)
     st.set_page_config(layout="centered")
 
-    # Access secrets from Streamlit
-    credentials_dict = st.secrets["google_api"]
-
-    # Use the dictionary directly with gspread
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict)
-    client = gspread.authorize(credentials)
-
-    # Open your Google Sheet
-    sheet = client.open("Entry_Form").worksheet("Students_HGH")
-
-    # Fetch all existing data from the sheet
-    existing_data = pd.DataFrame(sheet.get_all_records())
-
-    # Ensure 'studid' column is treated as strings to avoid AttributeError
-    if 'studid' in existing_data.columns:
-        existing_data['studid'] = existing_data['studid'].astype(str)
+    # The school the user logged in to; only its worksheets are read and written
+    tenant = auth.current_tenant()
 
     # Define dropdown options for fields
     school_options = ["Opsie A", "Opsie B", "Opsie C"]
@@ -45,33 +33,10 @@ else:
     # Input field for student ID
     student_id = st.text_input("Student ID")
 
-    # Calculate gender and age based on ID
-    if len(student_id) == 13:
-        # Extract birth date from ID (YYMMDD format)
-        birth_year = int(student_id[0:2])
-        birth_month = int(student_id[2:4])
-        birth_day = int(student_id[4:6])
-        
-        # Determine if the year is in the 1900s or 2000s
-        current_year = datetime.now().year
-        if birth_year > int(str(current_year)[2:]):
-            birth_year += 1900
-        else:
-            birth_year += 2000
-        
-        # Calculate age
-        birth_date = datetime(birth_year, birth_month, birth_day)
-        age = current_year - birth_date.year - ((datetime.now().month, datetime.now().day) < (birth_month, birth_day))
-        
-        # Determine gender based on the 7th digit
-        gender_digit = int(student_id[6])
-        if gender_digit >= 5:
-            gender = "Male"
-        else:
-            gender = "Female"
-    else:
-        age = None
-        gender = None
+    # Calculate gender and age based on ID; invalid IDs (bad date or check digit) give None
+    age, gender = parse_id(student_id)
+    if student_id and age is None:
+        st.error("Invalid student ID: check the birth date and the last digit.")
 
     # Input fields for creating a new student
     student_name = st.text_input("Student Name").title()
@@ -109,18 +74,68 @@ else:
                 "sport": sport_status,
                 "culture": culture_status,
                 "leader": leader_status,
-                "p-point": ""  # Placeholder for p-point if needed
+                "p-point": ""
             }
 
-            # Convert the new student data to a DataFrame
-            new_student_df = pd.DataFrame([new_student])
-
-            # Append the new student data to the existing data in the DataFrame
-            updated_df = pd.concat([existing_data, new_student_df], ignore_index=True)
-
-            # Update the Google Sheet with the new student data
-            sheet.update([updated_df.columns.values.tolist()] + updated_df.values.tolist())
-
-            st.success(f"Student record for {student_name} has been added.")
+            # p-points from the weighted marks and statuses
+            new_student["p-point"] = points_for(new_student)
+
+            # Queue the new row; appends from other sessions go out in the same call
+            try:
+                data.add_students([new_student], tenant)
+            except data.WriteConflict:
+                st.error(f"A student with ID {student_id} already exists.")
+            else:
+                st.success(f"Student record for {student_name} has been added.")
+
+                # Only the new student is scored and slotted into the ranking
+                students_ranking = ranking.get_ranking(tenant)
+                rank = students_ranking.rank_of(str(data.as_read(student_id)))
+                if rank is not None:
+                    st.info(f"{student_name} has {new_student['p-point']} p-points, ranked {rank} of {len(students_ranking)}.")
         else:
             st.warning("Please fill in all the required fields.")
+
+    # Bulk import of a whole intake from a CSV or Excel file
+    st.title("Import Students From File")
+    st.write("The file needs the columns: " + ", ".join(bulk_import.REQUIRED_COLUMNS))
+
+    uploaded_file = st.file_uploader("Student File", type=["csv", "xlsx"])
+
+    if uploaded_file is not None:
+        # Validate every row at once against the dropdown options and existing IDs
+        choices = {
+            "school": school_options,
+            "siblings": siblings_options,
+            "sport": sport_options,
+            "culture": culture_options,
+            "leader": leader_options,
+        }
+        # The roster is only needed here, so the create form never waits for it
+        with st.spinner("Loading student data..."):
+            existing_data = data.get_students_snapshot(tenant)[1]
+        try:
+            accepted, rejected = bulk_import.prepare_import(
+                bulk_import.read_upload(uploaded_file), existing_data.get('studid', []), choices
+            )
+        except ValueError as error:
+            st.error(f"Could not read the file: {error}")
+        else:
+            if not rejected.empty:
+                st.warning(f"{len(rejected)} row(s) will be skipped.")
+                st.dataframe(rejected)
+
+            st.write(f"### {len(accepted)} Student(s) Ready to Import")
+            st.dataframe(accepted)
+
+            # Write all accepted students in one batched append
+            if not accepted.empty and st.button("Import Students"):
+                try:
+                    data.add_students(bulk_import.to_records(accepted), tenant)
+                except data.WriteConflict as conflict:
+                    st.error(f"Nothing was imported: {conflict}.")
+                else:
+                    st.success(f"{len(accepted)} student records have been added.")
+
+# Log this run and show the performance panel to admins
+tracing.finish_page(auth.current_user())
@@ -1,11 +1,14 @@
 # second_page.py
 
-import gspread
-import pandas as pd
 import streamlit as st
-from oauth2client.service_account import ServiceAccountCredentials
 
-if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
+from utils import auth, data, filters, ranking, search, table, tracing
+from utils.derived import points_for
+
+# Time the stages of this run for the performance log
+tracing.start_page("2_Table")
+
+if not auth.is_logged_in():
     # Redirect to Login page if not logged in
     st.query_params.update({'page': 'Login'})
     st.title("Please log in first")
@@ -14,22 +17,13 @@ else:
     # Set page layout to centered (default)
     st.set_page_config(layout="centered")
 
-    # Access secrets from Streamlit
-    credentials_dict = st.secrets["google_api"]
-
-    # Use the dictionary directly with gspread
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict)
-    client = gspread.authorize(credentials)
-
-    # Open your Google Sheet
-    sheet = client.open("Entry_Form").worksheet("Students_HGH")
+    # The school the user logged in to; only its worksheets are read and written
+    tenant = auth.current_tenant()
 
-    # Fetch all existing data from the sheet
-    existing_data = pd.DataFrame(sheet.get_all_records())
-
-    # Ensure 'studid' column is treated as strings to avoid AttributeError
-    if 'studid' in existing_data.columns:
-        existing_data['studid'] = existing_data['studid'].astype(str)
+    # The shared cached roster, normally warmed while logging in. The page only
+    # reads it, so it is not copied.
+    with st.spinner("Loading student data..."):
+        existing_data = data.get_students_snapshot(tenant)[1]
 
     # Define dropdown options for fields
     school_options = ["Opsie A", "Opsie B", "Opsie C"]
@@ -44,13 +38,28 @@ else:
     # Dropdown to select action: Update or Delete
     action = st.selectbox("Select Action", ["Select Action", "Update", "Delete"])
 
-    # Text input to enter Student ID to delete or update
-    student_id_input = st.text_input("Enter Student ID to " + action)
+    # Search the roster by name, surname or Student ID; the index forgives typos
+    # and ranks the best matches first
+    search_query = st.text_input("Find the student to " + action + " by name, surname or Student ID")
+    matches = search.get_search_index(tenant).search(search_query) if search_query else []
+
+    # Pick one of the matches, the best one by default
+    student_id_input = None
+    if matches:
+        labels = {match['studid']: " ".join(match[column] for column in search.SEARCH_COLUMNS[1:] if match.get(column)) + f" ({match['studid']})" for match in matches}
+        student_id_input = st.selectbox("Matching Students", list(labels), format_func=labels.get)
 
-    # Validate if a valid student ID is entered
-    if student_id_input and student_id_input in existing_data['studid'].values:
+    # Look the student's row up by ID rather than scanning the roster
+    student_row = data.get_student_row(student_id_input, tenant) if student_id_input else None
+    if student_row is not None and student_row - 2 < len(existing_data) and existing_data['studid'].iat[student_row - 2] == student_id_input:
         # Retrieve the selected student record
-        selected_record = existing_data[existing_data['studid'] == student_id_input].iloc[0]
+        selected_record = existing_data.iloc[student_row - 2]
+
+        # Remember the version of the record as first shown, so saving refuses to
+        # overwrite changes another session made while this one was editing
+        if st.session_state.get('record_base', (None, None))[0] != student_id_input:
+            st.session_state['record_base'] = (student_id_input, data.student_version(student_id_input, tenant))
+        base_version = st.session_state['record_base'][1]
 
         if action == "Update":
             st.subheader(f"Update Student Record: {student_id_input}")
@@ -78,25 +87,47 @@ else:
                 # Calculate the average score
                 average_score = round((maths_marks + english_marks + afr_marks) / 3, 2)
 
-                # Update the record in the DataFrame
-                index_to_update = existing_data[existing_data['studid'] == student_id_input].index[0]
-                existing_data.at[index_to_update, 'name'] = student_name
-                existing_data.at[index_to_update, 'midlename'] = student_midlename
-                existing_data.at[index_to_update, 'surname'] = student_surname
-                existing_data.at[index_to_update, 'school'] = school_from
-                existing_data.at[index_to_update, 'maths'] = maths_marks
-                existing_data.at[index_to_update, 'english'] = english_marks
-                existing_data.at[index_to_update, 'afrikaans'] = afr_marks
-                existing_data.at[index_to_update, 'siblings'] = siblings_status
-                existing_data.at[index_to_update, 'sport'] = sport_status
-                existing_data.at[index_to_update, 'culture'] = culture_status
-                existing_data.at[index_to_update, 'leader'] = leader_status
-                existing_data.at[index_to_update, 'average'] = average_score
-
-                # Update the Google Sheet with the modified DataFrame
-                sheet.update([existing_data.columns.values.tolist()] + existing_data.values.tolist())
-
-                st.success(f"Student record for {student_id_input} has been updated.")
+                # New values for every editable field
+                new_values = {
+                    'name': student_name,
+                    'midlename': student_midlename,
+                    'surname': student_surname,
+                    'school': school_from,
+                    'maths': maths_marks,
+                    'english': english_marks,
+                    'afrikaans': afr_marks,
+                    'siblings': siblings_status,
+                    'sport': sport_status,
+                    'culture': culture_status,
+                    'leader': leader_status,
+                    'average': average_score,
+                }
+
+                # p-points of the edited record; only this student's score changes
+                new_values['p-point'] = points_for({**selected_record.to_dict(), **new_values})
+
+                # Only the cells that actually changed are sent to the Google Sheet
+                changes = {column: value for column, value in new_values.items() if selected_record.get(column) != value}
+
+                # Queue the changed cells; they go out batched with other sessions' saves
+                try:
+                    updated = data.update_student(student_id_input, changes, base_version, tenant)
+                except data.WriteConflict:
+                    updated = None
+                    del st.session_state['record_base']
+                    st.error("This record was changed by someone else while you were editing it. Reload it and apply your changes again.")
+
+                if updated:
+                    st.session_state['record_base'] = (student_id_input, data.student_version(student_id_input, tenant))
+                    st.success(f"Student record for {student_id_input} has been updated.")
+
+                    # The ranking moves just this student to their new place
+                    students_ranking = ranking.get_ranking(tenant)
+                    rank = students_ranking.rank_of(student_id_input)
+                    if rank is not None:
+                        st.info(f"{new_values['p-point']} p-points, ranked {rank} of {len(students_ranking)}.")
+                elif updated is False:
+                    st.error("Error: Could not find the student record in Google Sheets.")
 
         elif action == "Delete":
             st.subheader(f"Delete Student Record: {student_id_input}")
@@ -108,47 +139,29 @@ else:
 
             # Button to confirm deletion
             if st.button("Delete Record"):
-                # Delete the selected record from the DataFrame
-                existing_data = existing_data[existing_data['studid'] != student_id_input]
-
-                # Find the row index in Google Sheets for deletion
-                cell = sheet.find(student_id_input)
-                if cell:
-                    # Delete the row in Google Sheets
-                    sheet.delete_rows(cell.row)
-
-                    # Update the DataFrame after deletion
+                # Delete the student's known row in Google Sheets directly
+                try:
+                    deleted = data.delete_student(student_id_input, base_version, tenant)
+                except data.WriteConflict:
+                    deleted = None
+                    del st.session_state['record_base']
+                    st.error("This record was changed by someone else. Check the new details before deleting it.")
+
+                if deleted:
                     st.success(f"Student record for {student_id_input} has been deleted from the Google Sheet and DataFrame.")
-                else:
+                elif deleted is False:
                     st.error("Error: Could not find the student record in Google Sheets.")
 
     else:
-        if student_id_input and action != "Select Action":
-            st.warning("Please enter a valid Student ID.")
+        if search_query and action != "Select Action":
+            st.warning("No student matches your search.")
 
     # Display the title and data
     st.title("Student Data")
 
-    # Number of records per page
-    records_per_page = 20
-
-    # Calculate total number of pages
-    total_records = len(existing_data)
-    total_pages = (total_records // records_per_page) + (1 if total_records % records_per_page != 0 else 0)
-
-    # Create a selectbox for page selection
-    page_number = st.number_input(
-        "Select Page Number", min_value=1, max_value=total_pages, value=1, step=1
-    )
+    # Only the visible page of the shared roster is sent to the browser
+    engine = filters.get_filter_engine(tenant)
+    table.render_table("student_data", engine.frame, engine.version, sorter=engine.sorted_rows)
 
-    # Calculate the starting and ending indices of the records to display
-    start_idx = (page_number - 1) * records_per_page
-    end_idx = start_idx + records_per_page
-
-    # Display the records for the current page
-    st.write(f"Displaying records {start_idx + 1} to {min(end_idx, total_records)}")
-
-    if not existing_data.empty:
-        st.dataframe(existing_data.iloc[start_idx:end_idx])  # Display the records for the current page
-    else:
-        st.warning("No data available to display.")
+# Log this run and show the performance panel to admins
+tracing.finish_page(auth.current_user())
@@ -1,13 +1,13 @@
 # filter_page.py
 
-from io import StringIO
-
-import gspread
-import pandas as pd
 import streamlit as st
-from oauth2client.service_account import ServiceAccountCredentials
 
-if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
+from utils import auth, export, filters, overview, ranking, table, tracing
+
+# Time the stages of this run for the performance log
+tracing.start_page("3_Filter")
+
+if not auth.is_logged_in():
     # Redirect to Login page if not logged in
     st.query_params.update({'pages': 'Login'})
     st.title("Please log in first")
@@ -16,33 +16,24 @@ else:
     # Set page layout to centered (default)
     st.set_page_config(layout="centered")
 
-    # Access secrets from Streamlit
-    credentials_dict = st.secrets["google_api"]
-
-    # Use the dictionary directly with gspread
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict)
-    client = gspread.authorize(credentials)
-
-    # Open your Google Sheet
-    sheet = client.open("Entry_Form").worksheet("Students_HGH")
+    # The school the user logged in to; only its worksheets are read and written
+    tenant = auth.current_tenant()
 
-    # Fetch all existing data from the sheet
-    existing_data = pd.DataFrame(sheet.get_all_records())
+    # Shared filter engine over a compact copy of the roster; this page only reads it
+    with st.spinner("Loading student data..."):
+        engine = filters.get_filter_engine(tenant)
+    existing_data = engine.frame
 
-    # Ensure 'studid' column is treated as strings to avoid AttributeError
-    if 'studid' in existing_data.columns:
-        existing_data['studid'] = existing_data['studid'].astype(str)
-
-    # Calculate min and max values for 'average' column
-    min_average = int(existing_data['average'].min())
-    max_average = int(existing_data['average'].max())
+    # Min and max values for 'average' column, computed once per roster version
+    min_average = engine.min_average
+    max_average = engine.max_average
 
     # Display the title
     st.title("Filter Student Records")
 
     # Display the data table
     st.write("### All Student Records")
-    st.dataframe(existing_data)
+    table.render_table("all_records", existing_data, engine.version, sorter=engine.sorted_rows)
 
     # State management for filters
     if 'selected_schools' not in st.session_state:
@@ -63,7 +54,7 @@ else:
 
     with col1:
         # Multiselect widget for filtering by primary school
-        school_options = existing_data['school'].unique().tolist()  # Get unique schools from the data
+        school_options = engine.schools  # Unique schools, precomputed by the engine
         selected_schools = st.multiselect("Select Primary School(s) to Filter", school_options, default=st.session_state['selected_schools'])
 
         # Sorting options
@@ -82,55 +73,62 @@ else:
         # Selector for number of rows to print
         num_rows = st.number_input("Select Number of Rows to Print", min_value=1, max_value=len(existing_data), value=5)
 
-    # Filter the data based on selected schools
-    if selected_schools:
-        filtered_data = existing_data[existing_data['school'].isin(selected_schools)]
-    else:
-        filtered_data = existing_data  # Show all data if no school is selected
-
-    # Further filter the data based on the average score range
-    filtered_data = filtered_data[
-        (filtered_data['average'] >= selected_average_range[0]) & 
-        (filtered_data['average'] <= selected_average_range[1])
-    ]
-
-    # Apply sorting to the filtered data
-    if sort_column != 'None':
-        if sort_order == "Ascending":
-            filtered_data = filtered_data.sort_values(by=sort_column, ascending=True)
-        elif sort_order == "Descending":
-            filtered_data = filtered_data.sort_values(by=sort_column, ascending=False)
+    # Filter by school and average range and sort, reusing cached results for repeated states
+    filtered_rows = engine.query(selected_schools, selected_average_range, sort_column, sort_order)
 
     # Display the sorted and filtered data table
     st.write("### Filtered Student Records")
-    st.dataframe(filtered_data)
+    table.render_table("filtered_records", existing_data, engine.version, rows=filtered_rows)
 
     with col3:
-        # Button to print the filtered data
-        if st.button("Print Filtered Data"):
-            # Get the first 'num_rows' from the filtered data
-            data_to_print = filtered_data.head(num_rows)
-            
-            # Convert the data to CSV format
-            csv_data = data_to_print.to_csv(index=False)
-            
-            # Provide download button for CSV
-            st.download_button(
-                label="Download Filtered Data as CSV",
-                data=csv_data,
-                file_name='filtered_student_data.csv',
-                mime='text/csv'
-            )
-
-        # Button to print the original data
-        if st.button("Print Original Data"):
-            # Convert the original data to CSV format
-            original_csv_data = existing_data.to_csv(index=False)
-            
-            # Provide download button for CSV
-            st.download_button(
-                label="Download Original Data as CSV",
-                data=original_csv_data,
-                file_name='original_student_data.csv',
-                mime='text/csv'
-            )
+        # Export format for both downloads
+        export_format = st.selectbox("Export Format", list(export.EXPORT_FORMATS))
+        extension, mime = export.EXPORT_FORMATS[export_format]
+
+        # The files are only built when a button is clicked, streamed to disk in
+        # chunks and reused for repeated downloads of the same view and data version
+        filtered_view = ("filtered", tuple(sorted(selected_schools)), tuple(selected_average_range), sort_column, sort_order, num_rows)
+        st.download_button(
+            label=f"Download Filtered Data as {export_format}",
+            data=lambda: export.export_bytes(existing_data, engine.version, filtered_rows[:num_rows], filtered_view, export_format),
+            file_name=f'filtered_student_data.{extension}',
+            mime=mime,
+            on_click="ignore"
+        )
+
+        st.download_button(
+            label=f"Download Original Data as {export_format}",
+            data=lambda: export.export_bytes(existing_data, engine.version, range(len(existing_data)), ("original",), export_format),
+            file_name=f'original_student_data.{extension}',
+            mime=mime,
+            on_click="ignore"
+        )
+
+    # Live admissions ranking by p-points
+    st.write("### Rankings")
+    students_ranking = ranking.get_ranking(tenant)
+
+    rank_col1, rank_col2, rank_col3 = st.columns(3)
+    with rank_col1:
+        rank_group = st.selectbox("Rank Within", ["All Students", "School", "Gender"])
+    with rank_col2:
+        if rank_group == "School":
+            rank_value = st.selectbox("School", school_options)
+        elif rank_group == "Gender":
+            rank_value = st.selectbox("Gender", ["Female", "Male"])
+        else:
+            rank_value = None
+    with rank_col3:
+        top_k = st.number_input("Number of Students", min_value=1, max_value=max(1, len(students_ranking)), value=min(10, max(1, len(students_ranking))))
+
+    # Top students come straight off the maintained order; nothing is re-sorted
+    rank_column = {"School": "school", "Gender": "gender"}.get(rank_group)
+    st.dataframe(students_ranking.top(top_k, rank_column, rank_value), hide_index=True)
+
+    # Figures for every school, added up from per-school summaries; only listed staff see them
+    if overview.can_view(auth.current_user()):
+        st.write("### All Schools")
+        st.dataframe(overview.cross_school_view(), hide_index=True)
+
+# Log this run and show the performance panel to admins
+tracing.finish_page(auth.current_user())
@@ -0,0 +1,65 @@
+# dashboard_page.py
+
+import pandas as pd
+import streamlit as st
+
+from utils import auth, statistics, tracing
+
+# Time the stages of this run for the performance log
+tracing.start_page("4_Dashboard")
+
+if not auth.is_logged_in():
+    # Redirect to Login page if not logged in
+    st.query_params.update({'page': 'Login'})
+    st.title("Please log in first")
+else:
+
+    # Set page layout to centered (default)
+    st.set_page_config(layout="centered")
+
+    # The school the user logged in to; only its worksheets are read and written
+    tenant = auth.current_tenant()
+
+    # Display the title
+    st.title("Dashboard")
+
+    # The figures are kept up to date as records change, so reading them never
+    # scans the roster
+    with st.spinner("Loading student data..."):
+        summary = statistics.get_stats(tenant).summary()
+    numbers = summary["numbers"]
+
+    # Headline figures
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Students", summary["students"])
+    col2.metric("Mean Average", numbers["average"]["mean"] if numbers["average"]["count"] else "-")
+    col3.metric("Lowest Average", numbers["average"]["min"] if numbers["average"]["count"] else "-")
+    col4.metric("Highest Average", numbers["average"]["max"] if numbers["average"]["count"] else "-")
+
+    # Students per primary school
+    st.write("### Students per Primary School")
+    st.bar_chart(statistics.as_series(summary["counts"]["school"], "Students"))
+
+    # Gender and age breakdowns side by side
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write("### Gender")
+        st.bar_chart(statistics.as_series(summary["counts"]["gender"], "Students"))
+    with col2:
+        st.write("### Age")
+        st.bar_chart(statistics.as_series(summary["counts"]["age"], "Students"))
+
+    # Lowest, highest and mean of every mark
+    subject_names = {"maths": "Mathematics", "english": "English", "afrikaans": "Afrikaans", "average": "Average", "p-point": "p-points"}
+    st.write("### Marks")
+    st.dataframe(pd.DataFrame([
+        {"Mark": subject_names[column], "Lowest": stat["min"], "Highest": stat["max"], "Mean": stat["mean"], "Students": stat["count"]}
+        for column, stat in numbers.items()
+    ]), hide_index=True)
+
+    # Distribution of one subject's marks
+    subject = st.selectbox("Mark Distribution", statistics.MARK_COLUMNS, format_func=subject_names.get)
+    st.bar_chart(statistics.as_series(summary["histograms"][subject], "Students"))
+
+# Log this run and show the performance panel to admins
+tracing.finish_page(auth.current_user())
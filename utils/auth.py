@@ -0,0 +1,137 @@
+# auth.py
+
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt  # For password hashing
+import streamlit as st
+
+from utils import data
+from utils.config import get_setting
+from utils.tenants import get_tenant, get_tenants
+
+# How long a signed session token stays valid, in seconds
+DEFAULT_SESSION_LIFETIME = 12 * 60 * 60
+
+# username -> password hash, rebuilt from a school's Users worksheet once the TTL expires
+class CredentialIndex:
+
+    def __init__(self, ttl, tenant):
+        self.ttl = ttl
+        self.tenant = tenant
+        self._lock = threading.Lock()
+        self._hashes = None
+        self._loaded_at = 0
+
+    def get_hash(self, username):
+        with self._lock:
+            if self._hashes is None or time.monotonic() - self._loaded_at >= self.ttl:
+                users = data.get_users(self.tenant)
+                self._hashes = {}
+                if {'username', 'password'} <= set(users.columns):
+                    # The first record of a username wins, as it always has
+                    for name, password in zip(users['username'].astype(str), users['password'].astype(str)):
+                        self._hashes.setdefault(name, password)
+                self._loaded_at = time.monotonic()
+            return self._hashes.get(username)
+
+
+@st.cache_resource
+def _credential_index(code):
+    return CredentialIndex(data.get_ttl(), code)
+
+
+def get_credential_index(tenant=None):
+    return _credential_index(get_tenant(tenant).code)
+
+
+# bcrypt is deliberately slow and releases the GIL, so one check per CPU core runs
+# at full speed; more would only slow every check down. A burst of logins queues
+# here instead of starving the server's CPU.
+@st.cache_resource
+def get_login_pool():
+    workers = int(get_setting("login_workers", os.cpu_count() or 1))
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+
+def _check_password(stored_password_hash, password):
+    # Check the entered password against the stored hashed password
+    return bcrypt.checkpw(password.encode('utf-8'), stored_password_hash.encode('utf-8'))
+
+
+# Start checking a login against a school's users and return a Future that
+# resolves to True or False, leaving the caller free to do other work while bcrypt runs
+def verify_login(username, password, tenant=None):
+    stored_password_hash = get_credential_index(tenant).get_hash(username)
+    if stored_password_hash is None:
+        future = get_login_pool().submit(lambda: False)
+    else:
+        future = get_login_pool().submit(_check_password, stored_password_hash, password)
+    return future
+
+
+# Key used to sign session tokens. Without a configured key a random one is used,
+# so tokens stay valid only until the server restarts.
+@st.cache_resource
+def get_signing_key():
+    configured = get_setting("session_secret")
+    return configured.encode('utf-8') if configured else secrets.token_bytes(32)
+
+
+def _sign(payload):
+    return hmac.new(get_signing_key(), payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+# Token of the form "username|school|expiry|signature"
+def issue_token(username, tenant=None):
+    lifetime = int(get_setting("session_lifetime", DEFAULT_SESSION_LIFETIME))
+    payload = f"{username}|{get_tenant(tenant).code}|{int(time.time()) + lifetime}"
+    return f"{payload}|{_sign(payload)}"
+
+
+# Return (username, school code) of a valid, unexpired token, or None
+def _verify(token):
+    try:
+        username, code, expires, signature = token.rsplit("|", 3)
+        expires = int(expires)
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(signature, _sign(f"{username}|{code}|{expires}")):
+        return None
+    if expires < time.time() or code not in get_tenants():
+        return None
+    return username, code
+
+
+# Return the username of a valid, unexpired token, or None
+def verify_token(token):
+    verified = _verify(token)
+    return verified[0] if verified else None
+
+
+# Remember a successful login in the session
+def log_in(username, tenant=None):
+    st.session_state['auth_token'] = issue_token(username, tenant)
+    st.session_state['logged_in'] = True
+    st.session_state['username'] = username
+
+
+# The logged-in user, checked against the token signature only; the password
+# and the Users worksheet are not looked at again for the rest of the session
+def current_user():
+    return verify_token(st.session_state.get('auth_token'))
+
+
+# Code of the school the user logged in to; its worksheets serve the session
+def current_tenant():
+    verified = _verify(st.session_state.get('auth_token'))
+    return verified[1] if verified else None
+
+
+def is_logged_in():
+    return current_user() is not None
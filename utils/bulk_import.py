@@ -0,0 +1,91 @@
+# bulk_import.py
+
+import pandas as pd
+
+from utils.derived import compute_points, get_weights
+from utils.student_id import normalize_ids, parse_ids, restore_ids
+
+# Columns an uploaded file has to provide; midlename may be left empty
+REQUIRED_COLUMNS = ["studid", "name", "midlename", "surname", "school", "maths", "english", "afrikaans", "siblings", "sport", "culture", "leader"]
+MARK_COLUMNS = ["maths", "english", "afrikaans"]
+
+# Column order of a student record, as written by the Create Student form
+RECORD_COLUMNS = ["studid", "name", "midlename", "surname", "gender", "age", "school", "maths", "english", "afrikaans", "average", "siblings", "sport", "culture", "leader", "p-point"]
+
+
+# Read an uploaded CSV or XLSX file; every value is kept as text so IDs keep their leading zeros
+def read_upload(uploaded_file):
+    if uploaded_file.name.lower().endswith(".xlsx"):
+        return pd.read_excel(uploaded_file, dtype=str, keep_default_na=False)
+    return pd.read_csv(uploaded_file, dtype=str, keep_default_na=False)
+
+
+# Validate all uploaded rows together and derive the computed columns.
+# choices maps dropdown columns (school, siblings, ...) to their allowed values.
+# Returns (accepted records DataFrame, rejected rows DataFrame with a 'reason').
+def prepare_import(upload, existing_ids, choices):
+    missing = [column for column in REQUIRED_COLUMNS if column not in upload.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    rows = upload[REQUIRED_COLUMNS].apply(lambda column: column.str.strip())
+
+    # Spreadsheet programs store IDs as numbers and drop their leading zeros
+    rows["studid"] = restore_ids(rows["studid"])
+    reasons = pd.Series("", index=rows.index)
+
+    def reject(mask, reason):
+        reasons[mask & (reasons == "")] = reason
+
+    # Birth date, age and gender for every ID in one pass
+    parsed = parse_ids(rows["studid"])
+    reject(~parsed["valid"], "Invalid student ID")
+
+    # Duplicates inside the file and against students already in the sheet
+    ids = normalize_ids(rows["studid"])
+    reject(ids.duplicated(keep=False), "Student ID repeated in file")
+    reject(ids.isin(pd.Index(existing_ids)), "Student ID already exists")
+
+    reject((rows["name"] == "") | (rows["surname"] == ""), "Name and surname are required")
+
+    marks = rows[MARK_COLUMNS].apply(pd.to_numeric, errors="coerce")
+    reject((marks.isna() | (marks < 0) | (marks > 100) | (marks % 1 != 0)).any(axis=1), "Marks must be whole numbers from 0 to 100")
+
+    for column, options in choices.items():
+        reject(~rows[column].isin(options), f"Unknown {column}")
+
+    accepted = reasons == ""
+    records = pd.DataFrame({
+        "studid": rows["studid"],
+        "name": rows["name"].str.title(),
+        "midlename": rows["midlename"].str.title(),
+        "surname": rows["surname"].str.title(),
+        "gender": parsed["gender"],
+        "age": parsed["age"],
+        "school": rows["school"],
+        "maths": marks["maths"],
+        "english": marks["english"],
+        "afrikaans": marks["afrikaans"],
+        # Calculate the average score of all rows column-wise
+        "average": marks.mean(axis=1).round(2),
+        "siblings": rows["siblings"],
+        "sport": rows["sport"],
+        "culture": rows["culture"],
+        "leader": rows["leader"],
+        "p-point": "",
+    }, columns=RECORD_COLUMNS)[accepted]
+
+    # Stored as whole numbers, like the number inputs produce
+    for column in MARK_COLUMNS + ["age"]:
+        records[column] = records[column].astype(int)
+
+    # p-points for all accepted rows column-wise
+    records["p-point"] = compute_points(records, get_weights())
+
+    rejected = upload[~accepted].assign(reason=reasons[~accepted])
+    return records, rejected
+
+
+# Plain Python records ready for data.add_students
+def to_records(records):
+    return records.astype(object).to_dict("records")
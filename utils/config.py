@@ -0,0 +1,12 @@
+# config.py
+
+import streamlit as st
+
+
+# Read a setting from the Streamlit secrets. Offline setups may have no secrets
+# file at all, in which case every setting falls back to its default.
+def get_setting(key, default=None):
+    try:
+        return st.secrets.get(key, default)
+    except FileNotFoundError:
+        return default
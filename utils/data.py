@@ -0,0 +1,666 @@
+# data.py
+
+import itertools
+import logging
+import threading
+import time
+from functools import partial
+
+import pandas as pd
+import streamlit as st
+from gspread.utils import numericise, numericise_all
+
+from utils import derived
+from utils.config import get_setting
+from utils.replica import get_replica, row_hash
+from utils.sheets import SPREADSHEET_NAME
+from utils.storage import get_storage
+from utils.tenants import MB, get_tenant
+from utils.tracing import span
+from utils.writes import WriteConflict, WriteOp, get_write_queue
+
+logger = logging.getLogger(__name__)
+
+# Number of seconds a downloaded worksheet is reused before it is fetched again
+DEFAULT_TTL = 300
+
+# Memory all schools' cached worksheets may use together
+DEFAULT_SERVER_MEMORY_MB = 512
+
+
+# Key column used to look students up and map them to sheet rows
+KEY_COLUMN = 'studid'
+
+# Times in a row a roster service rebuilds when the roster keeps changing underneath it
+MAX_REBUILDS = 3
+
+
+# Versions are unique across every school's cache, so structures keyed on a
+# version (filter engines, Arrow tables, exports) never mix up two schools
+_versions = itertools.count(1)
+
+
+# A cached worksheet: its DataFrame plus a lazily built key -> sheet row mapping.
+# The version changes whenever the DataFrame does, so derived structures built
+# from it (filter indexes, exports, ...) can be keyed on it.
+class CachedSheet:
+
+    def __init__(self, frame, version):
+        self.loaded_at = time.monotonic()
+        self.used_at = self.loaded_at
+        self.frame = frame
+        self.version = version
+        self.rows = None
+        # Structures built from this version of the DataFrame (see DatasetCache.derive)
+        self.derived = {}
+        # Memory used by the DataFrame, measured once when loaded
+        self.frame_nbytes = int(frame.memory_usage(deep=True).sum())
+
+    # Memory used by the DataFrame and the structures built from it
+    @property
+    def nbytes(self):
+        return self.frame_nbytes + sum(getattr(value, "nbytes", 0) for value in list(self.derived.values()))
+
+    # Map each key to its sheet row (row 1 is the header); the first match wins
+    def row_map(self):
+        if self.rows is None:
+            keys = self.frame[KEY_COLUMN].tolist() if KEY_COLUMN in self.frame.columns else []
+            self.rows = {}
+            for position, key in enumerate(keys):
+                self.rows.setdefault(key, position + 2)
+        return self.rows
+
+
+# Process-wide cache of one school's worksheet DataFrames, shared by every
+# session. Beyond budget bytes the least recently used worksheets are dropped;
+# on_grow(name) is called whenever a worksheet was downloaded or more was built from it.
+class DatasetCache:
+
+    def __init__(self, ttl, budget=None, on_grow=None):
+        self.ttl = ttl
+        self.budget = budget
+        self.on_grow = on_grow
+        self._lock = threading.Lock()
+        self._name_locks = {}
+        self._entries = {}
+        self._used_at = 0
+
+    # One lock per worksheet so only one session downloads it while the others wait
+    def _name_lock(self, name):
+        with self._lock:
+            return self._name_locks.setdefault(name, threading.Lock())
+
+    def _is_fresh(self, entry):
+        return entry is not None and time.monotonic() - entry.loaded_at < self.ttl
+
+    # Must be called while holding the worksheet lock
+    def _load(self, name, loader):
+        entry = self._entries.get(name)
+        if not self._is_fresh(entry):
+            with span(f"dataset.load {name}"):
+                entry = CachedSheet(loader(name), next(_versions))
+            self._entries[name] = entry
+            self._evict(keep=name)
+            if self.on_grow is not None:
+                self.on_grow(name)
+        entry.used_at = self._used_at = time.monotonic()
+        return entry
+
+    # Drop the least recently used other worksheets while over the memory budget
+    def _evict(self, keep):
+        with self._lock:
+            while self.budget is not None and sum(entry.nbytes for entry in self._entries.values()) > self.budget:
+                others = [name for name in self._entries if name != keep]
+                if not others:
+                    break
+                del self._entries[min(others, key=lambda name: self._entries[name].used_at)]
+
+    # Memory used by the cached worksheets
+    def nbytes(self):
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    # When any worksheet was last read, even if it has been dropped since (0 if never)
+    def last_used(self):
+        return self._used_at
+
+    # Return a copy of the cached DataFrame, loading it if missing or expired
+    def get(self, name, loader):
+        with self._name_lock(name):
+            # Pages modify their DataFrame in place, so never hand out the cached one
+            return self._load(name, loader).frame.copy()
+
+    # Return (version, DataFrame) without copying; callers must not modify it
+    def snapshot(self, name, loader):
+        with self._name_lock(name):
+            entry = self._load(name, loader)
+            return entry.version, entry.frame
+
+    # Name of the cached worksheet at version, or None
+    def find(self, version):
+        with self._lock:
+            for name, entry in self._entries.items():
+                if entry.version == version:
+                    return name
+        return None
+
+    # Structure built by build() from one version of a worksheet (an Arrow copy, a
+    # filter engine, ...) and shared by every session. It is kept in the
+    # worksheet's entry, so its nbytes count toward the budget and it goes when the
+    # worksheet or that version does. Versions no longer cached get an unkept build.
+    def derive(self, name, version, key, build):
+        with self._name_lock((name, key)):
+            entry = self._entries.get(name)
+            if entry is None or entry.version != version:
+                return build()
+            derived = entry.derived
+            if key in derived:
+                return derived[key]
+            value = build()
+
+            # A patch during the build moved the entry on to a new version (with an
+            # empty dict); what was built belongs to the old one and is not kept
+            with self._name_lock(name):
+                if self._entries.get(name) is not entry or entry.version != version:
+                    return value
+                derived[key] = value
+            self._evict(keep=name)
+            if self.on_grow is not None:
+                self.on_grow(name)
+            return value
+
+    # Return the sheet row holding key, or None if the key is unknown
+    def row_of(self, name, key, loader):
+        with self._name_lock(name):
+            return self._load(name, loader).row_map().get(key)
+
+    # Whether a worksheet is cached and fresh, i.e. a read won't have to wait for a download
+    def is_ready(self, name):
+        return self._is_fresh(self._entries.get(name))
+
+    # Version of a fresh cached worksheet, or None when reading it would download it
+    def cached_version(self, name):
+        entry = self._entries.get(name)
+        return entry.version if self._is_fresh(entry) else None
+
+    # Return the cached DataFrame itself (or None) for read-only use
+    def peek(self, name):
+        entry = self._entries.get(name)
+        return entry.frame if entry is not None else None
+
+    # Replace the cached DataFrame with func(copy of DataFrame) without refetching
+    # it. func works on a copy because snapshots hand the cached one out to
+    # readers. If func returns None the cached copy is dropped instead.
+    def patch(self, name, func):
+        with self._name_lock(name):
+            entry = self._entries.get(name)
+            if entry is not None:
+                patched = func(entry.frame.copy())
+                if patched is None:
+                    del self._entries[name]
+                else:
+                    entry.frame = patched
+                    entry.version = next(_versions)
+                    entry.rows = None
+                    entry.derived = {}
+
+    # Drop one worksheet (or everything) so the next read downloads it again
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+
+# Read the cache lifetime from the secrets, falling back to the default
+def get_ttl():
+    return int(get_setting("cache_ttl", DEFAULT_TTL))
+
+
+# Every school's cache, with a server-wide memory budget on top of each school's
+# own. When the schools together use more, the caches of the schools used least
+# recently are emptied until the total fits again.
+class TenantCaches:
+
+    def __init__(self, ttl, budget):
+        self.ttl = ttl
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._caches = {}
+
+    def get(self, tenant):
+        with self._lock:
+            if tenant.code not in self._caches:
+                self._caches[tenant.code] = DatasetCache(
+                    self.ttl, tenant.memory_budget, lambda name: self.enforce(keep=tenant.code)
+                )
+            return self._caches[tenant.code]
+
+    # DatasetCache.derive on whichever school's cache holds version
+    def derive(self, version, key, build):
+        with self._lock:
+            caches = list(self._caches.values())
+        for cache in caches:
+            name = cache.find(version)
+            if name is not None:
+                return cache.derive(name, version, key, build)
+        return build()
+
+    # {school code: bytes cached}
+    def usage(self):
+        with self._lock:
+            caches = dict(self._caches)
+        return {code: cache.nbytes() for code, cache in caches.items()}
+
+    def enforce(self, keep):
+        with self._lock:
+            caches = dict(self._caches)
+        total = sum(cache.nbytes() for cache in caches.values())
+        for code, cache in sorted(caches.items(), key=lambda item: item[1].last_used()):
+            if total <= self.budget:
+                break
+            if code == keep:
+                continue
+            total -= cache.nbytes()
+            cache.invalidate()
+            _notify(code, "reload")
+
+
+@st.cache_resource
+def get_tenant_caches():
+    return TenantCaches(get_ttl(), int(float(get_setting("cache_memory_mb", DEFAULT_SERVER_MEMORY_MB)) * MB))
+
+
+# The cache of one school (the default school for None)
+def get_cache(tenant=None):
+    return get_tenant_caches().get(get_tenant(tenant))
+
+
+# Structure built by build() from a cached worksheet version, kept and budgeted
+# with that school's cache. Versions are unique across schools, so the version
+# alone says which school it belongs to.
+def derive(version, key, build):
+    return get_tenant_caches().derive(version, key, build)
+
+
+# Set one cell, widening the column to object when the value doesn't fit its
+# dtype (e.g. a decimal average into a column that only held whole numbers)
+def set_value(frame, index, column, value):
+    try:
+        frame.at[index, column] = value
+    except (TypeError, ValueError):
+        frame[column] = frame[column].astype(object)
+        frame.at[index, column] = value
+
+
+# A value as it will come back when the sheet is read again (what get_all_records
+# makes of it), so cache and replica patches match the next full load
+def as_read(value):
+    return numericise(str(value))
+
+
+# Ensure 'studid' column is treated as strings to avoid AttributeError
+def _prepare(data):
+    if KEY_COLUMN in data.columns:
+        data[KEY_COLUMN] = data[KEY_COLUMN].astype(str)
+    return data
+
+
+# Download a worksheet into a DataFrame, converting values like get_all_records
+def load_sheet(name, spreadsheet=SPREADSHEET_NAME):
+    values = get_storage(spreadsheet).read_all(name)
+    header = values[0] if values else []
+    return _prepare(pd.DataFrame([numericise_all(row) for row in values[1:]], columns=header))
+
+
+# Functions called as func(event, details) after a school's roster changed:
+#   "insert" {"records": [...]}, "update" {"studid": ..., "changes": {...}},
+#   "delete" {"studid": ...}, and "reload" {} when it was replaced wholesale
+#   or dropped from memory
+_student_listeners = {}
+
+
+def on_students_change(func, tenant=None):
+    listeners = _student_listeners.setdefault(get_tenant(tenant).code, [])
+    if func not in listeners:
+        listeners.append(func)
+
+
+def _notify(code, event, **details):
+    for func in list(_student_listeners.get(code, [])):
+        try:
+            func(event, details)
+        except Exception:
+            logger.exception("Roster listener of %s failed on %s", code, event)
+
+
+# A structure built from a school's roster and kept up to date from its change
+# events. factory() makes an empty one with rebuild(frame), upsert(studid,
+# changes) and remove(studid). After a wholesale reload it is swapped for an
+# empty one right away, so an evicted school frees its memory, and rebuilt
+# lazily by the next get(). Events and rebuilds take the same lock, so an event
+# arriving mid-rebuild is applied to the new structure once it is in place.
+class RosterService:
+
+    def __init__(self, tenant, factory):
+        self.tenant = tenant
+        self.factory = factory
+        self.current = factory()
+        self._stale = True
+        self._lock = threading.Lock()
+        on_students_change(self.on_change, tenant)
+
+    def on_change(self, event, details):
+        with self._lock:
+            if event == "reload":
+                self._stale = True
+                self.current = self.factory()
+            elif self._stale:
+                # The next rebuild reads the roster with this change in it
+                return
+            elif event == "insert":
+                for record in details["records"]:
+                    self.current.upsert(record[KEY_COLUMN], record)
+            elif event == "update":
+                self.current.upsert(details["studid"], details["changes"])
+            elif event == "delete":
+                self.current.remove(details["studid"])
+
+    def get(self):
+        with self._lock:
+            if self._stale:
+                # Build into a fresh structure; if the cached roster moved on to
+                # another version meanwhile (e.g. reloaded after its TTL), build again
+                for _ in range(MAX_REBUILDS):
+                    version, frame = get_students_snapshot(self.tenant)
+                    current = self.factory()
+                    current.rebuild(frame)
+                    if cached_students_version(self.tenant) == version:
+                        break
+                self.current = current
+                self._stale = False
+            return self.current
+
+
+# A school's students replica, wired to drop the cached roster whenever a sync
+# changes it. Takes the school code, never None, so each school is wired once.
+@st.cache_resource
+def get_students_replica(code):
+    replica = get_replica(code)
+    tenant = get_tenant(code)
+
+    def reload():
+        get_cache(code).invalidate(tenant.students_sheet)
+        _notify(code, "reload")
+
+    replica.on_change(reload)
+    replica.idle_when(partial(is_idle, code))
+    if get_setting("recompute_on_sync", True):
+        replica.after_sync(partial(recompute_derived_columns, tenant=code))
+    return replica
+
+
+# The roster straight from the replica, without loading it into the cache
+def read_students_replica(tenant=None):
+    return _prepare(get_students_replica(get_tenant(tenant).code).read_frame())
+
+
+# Students are read from the local replica instead of downloading the sheet
+def load_students(name, tenant=None):
+    return read_students_replica(tenant)
+
+
+def _read_students(method, tenant, *args):
+    tenant = get_tenant(tenant)
+    return getattr(get_cache(tenant.code), method)(tenant.students_sheet, *args, partial(load_students, tenant=tenant.code))
+
+
+def get_students(tenant=None):
+    return _read_students("get", tenant)
+
+
+# (version, roster) for read-only consumers that build their own structures from it
+def get_students_snapshot(tenant=None):
+    return _read_students("snapshot", tenant)
+
+
+# Whether get_students() will answer straight from the cache
+def students_ready(tenant=None):
+    tenant = get_tenant(tenant)
+    return get_cache(tenant.code).is_ready(tenant.students_sheet)
+
+
+# Version of the cached roster, or None if it is not in memory
+def cached_students_version(tenant=None):
+    tenant = get_tenant(tenant)
+    return get_cache(tenant.code).cached_version(tenant.students_sheet)
+
+
+# Whether nobody has read any of a school's worksheets for a whole cache TTL
+def is_idle(tenant=None):
+    return time.monotonic() - get_cache(tenant).last_used() >= get_ttl()
+
+
+def users_ready(tenant=None):
+    tenant = get_tenant(tenant)
+    return get_cache(tenant.code).is_ready(tenant.users_sheet)
+
+
+def get_users(tenant=None):
+    tenant = get_tenant(tenant)
+    return get_cache(tenant.code).get(tenant.users_sheet, partial(load_sheet, spreadsheet=tenant.spreadsheet))
+
+
+def patch_students(func, tenant=None):
+    tenant = get_tenant(tenant)
+    get_cache(tenant.code).patch(tenant.students_sheet, func)
+
+
+def invalidate_students(tenant=None):
+    tenant = get_tenant(tenant)
+    get_cache(tenant.code).invalidate(tenant.students_sheet)
+    _notify(tenant.code, "reload")
+
+
+# Queue a write to a school's Students worksheet and wait until it has landed
+def _write(tenant, kind, keys, prepare, apply, check=None):
+    queue = get_write_queue(tenant.students_sheet, tenant.spreadsheet)
+    with span(f"writes.{kind}"):
+        return queue.submit(WriteOp(kind, keys, prepare, apply, check)).result()
+
+
+# Version of a student's row as this process last saw it, or None if the ID is
+# unknown. Pages keep the version of the record they showed and pass it back
+# with their write, which is refused if the row changed in between.
+def student_version(studid, tenant=None):
+    row = get_student_row(studid, tenant)
+    if row is None:
+        return None
+    return row_hash([str(value) for value in get_students_snapshot(tenant)[1].iloc[row - 2].tolist()])
+
+
+def _check_version(studid, version, tenant):
+    if version is not None and student_version(studid, tenant) != version:
+        raise WriteConflict(f"Student {studid} was changed by someone else")
+
+
+# Append new student records (dicts keyed by column). Appends queued by other
+# sessions at the same time go out in the same API call. Returns the sheet row
+# number assigned to each record; raises WriteConflict if an ID already exists.
+def add_students(records, tenant=None):
+    if not records:
+        return []
+    tenant = get_tenant(tenant)
+
+    # Order the values like the sheet header, or like the records for an empty sheet
+    cached = get_cache(tenant.code).peek(tenant.students_sheet)
+    if cached is not None and len(cached.columns) > 0:
+        columns = cached.columns.tolist()
+    else:
+        columns = list(records[0].keys())
+    rows = [[record.get(column, "") for column in columns] for record in records]
+    stored_rows = [[as_read(value) for value in row] for row in rows]
+    studids = [str(as_read(record.get(KEY_COLUMN, ""))) for record in records]
+
+    # Another session may have added the same ID since the form was filled in
+    def check():
+        for studid in studids:
+            if get_student_row(studid, tenant.code) is not None:
+                raise WriteConflict(f"Student {studid} already exists")
+
+    def apply(first_row):
+        # Rows appended by another process in between leave a gap; resync the replica then
+        replica = get_students_replica(tenant.code)
+        if not replica.append(first_row, stored_rows):
+            replica.sync()
+
+        # Patch the cached copy when the rows landed right after it (row 1 is
+        # the header); otherwise someone else appended meanwhile and it must be reloaded
+        def append_to_cache(cached):
+            if first_row != len(cached) + 2:
+                return None
+            new_rows = _prepare(pd.DataFrame(stored_rows, columns=columns))
+            return pd.concat([cached, new_rows], ignore_index=True)
+
+        patch_students(append_to_cache, tenant.code)
+        _notify(tenant.code, "insert", records=_prepare(pd.DataFrame(stored_rows, columns=columns)).to_dict("records"))
+        return list(range(first_row, first_row + len(rows)))
+
+    return _write(tenant, "append", studids, lambda: rows, apply, check)
+
+
+# Column names of the roster, taken from the cache without copying it when possible
+def _student_columns(tenant):
+    cached = get_cache(tenant.code).peek(tenant.students_sheet)
+    return (cached if cached is not None else get_students(tenant.code)).columns.tolist()
+
+
+# Return the sheet row of a student, or None if the ID is unknown
+def get_student_row(studid, tenant=None):
+    return _read_students("row_of", tenant, studid)
+
+
+# Find the student's row and make sure the storage still has them there. If the
+# cached mapping is stale (rows deleted by another session) the student is looked
+# up by ID instead and the replica is resynced so row positions line up again.
+def _locate_student(studid, tenant):
+    queue = get_write_queue(tenant.students_sheet, tenant.spreadsheet)
+    row = get_student_row(studid, tenant.code)
+    if row is None or queue.read(queue.storage.key_at, row) == studid:
+        return row
+
+    row = queue.read(queue.storage.find_row, studid)
+    get_students_replica(tenant.code).sync()
+    invalidate_students(tenant.code)
+    return row
+
+
+# Write only the changed cells ({column: value}) of one student, batched with
+# updates from other sessions. Returns False if the student could not be found.
+# With the version from student_version(), raises WriteConflict if the row was
+# changed since.
+def update_student(studid, changes, version=None, tenant=None):
+    if not changes:
+        return True
+    tenant = get_tenant(tenant)
+
+    columns = _student_columns(tenant)
+    changes_read = {column: as_read(value) for column, value in changes.items()}
+
+    def prepare():
+        row = _locate_student(studid, tenant)
+        if row is None:
+            return None
+        return {row: {columns.index(column) + 1: value for column, value in changes.items()}}
+
+    def apply(payload):
+        (row, values), = payload.items()
+        get_students_replica(tenant.code).update(row, {col: as_read(value) for col, value in values.items()})
+
+        # Patch the cached copy; the row -> position mapping is unchanged by an update
+        def update_cache(cached):
+            for column, value in changes_read.items():
+                set_value(cached, row - 2, column, value)
+            return cached
+
+        patch_students(update_cache, tenant.code)
+        _notify(tenant.code, "update", studid=studid, changes=changes_read)
+        return True
+
+    return _write(tenant, "update", [studid], prepare, apply, lambda: _check_version(studid, version, tenant.code))
+
+
+# Delete one student's row directly, without searching the sheet for it.
+# Returns False if the student could not be found. With the version from
+# student_version(), raises WriteConflict if the row was changed since.
+def delete_student(studid, version=None, tenant=None):
+    tenant = get_tenant(tenant)
+
+    def apply(row):
+        get_students_replica(tenant.code).delete(row)
+
+        # Rows below the deleted one move up, so the mapping is rebuilt on next use
+        patch_students(lambda cached: cached.drop(index=row - 2).reset_index(drop=True), tenant.code)
+        _notify(tenant.code, "delete", studid=studid)
+        return True
+
+    return _write(
+        tenant, "delete", [studid], lambda: _locate_student(studid, tenant), apply,
+        lambda: _check_version(studid, version, tenant.code),
+    )
+
+
+# Write changed cells of many students ({studid: {column: value}}) in one API
+# call. Rows are looked up when the write goes out, so deletes written in the
+# meantime don't shift the changes onto the wrong students; IDs no longer in
+# the roster are skipped.
+def update_students(updates, tenant=None):
+    if not updates:
+        return
+    tenant = get_tenant(tenant)
+
+    columns = _student_columns(tenant)
+    changes = {
+        str(studid): {column: as_read(value) for column, value in values.items()}
+        for studid, values in updates.items()
+    }
+
+    located = {}
+
+    def prepare():
+        located.clear()
+        for studid in changes:
+            row = get_student_row(studid, tenant.code)
+            if row is not None:
+                located[row] = studid
+        return {row: {columns.index(column) + 1: value for column, value in changes[studid].items()} for row, studid in located.items()} or None
+
+    def apply(rows):
+        get_students_replica(tenant.code).update_many(rows)
+
+        def update_cache(cached):
+            for row, studid in located.items():
+                for column, value in changes[studid].items():
+                    set_value(cached, row - 2, column, value)
+            return cached
+
+        patch_students(update_cache, tenant.code)
+        for studid in located.values():
+            _notify(tenant.code, "update", studid=studid, changes=changes[studid])
+
+    _write(tenant, "update", changes, prepare, apply)
+
+
+# Bring age, gender, average and p-points of a school's roster up to date,
+# writing back only the rows that changed. Runs after every background sync;
+# returns the number of rows written. Idle schools are skipped, since writing
+# would load their roster back into memory and push other schools out; the
+# first sync after someone uses the school again catches up.
+def recompute_derived_columns(today=None, tenant=None):
+    tenant = get_tenant(tenant)
+    if is_idle(tenant.code):
+        return 0
+    changes = derived.recompute(read_students_replica(tenant.code), today, derived.get_weights())
+    update_students(changes, tenant.code)
+    return len(changes)
@@ -0,0 +1,90 @@
+# derived.py
+
+import numpy as np
+import pandas as pd
+
+from utils.config import get_setting
+from utils.student_id import parse_ids, restore_ids
+
+MARK_COLUMNS = ["maths", "english", "afrikaans"]
+
+# Default p-point weights, overridable in the [ranking] secrets, e.g.
+#   [ranking.marks]
+#   maths = 0.4
+#   [ranking.sport]
+#   "Opsie A" = 5
+# Each mark is multiplied by its weight; each status adds the points of its value.
+DEFAULT_WEIGHTS = {
+    "marks": {"maths": 1 / 3, "english": 1 / 3, "afrikaans": 1 / 3},
+    "siblings": {"Yes": 5, "No": 0},
+    "sport": {"Opsie A": 3, "Opsie B": 2, "Opsie C": 1},
+    "culture": {"Opsie A": 3, "Opsie B": 2, "Opsie C": 1},
+    "leader": {"Opsie A": 3, "Opsie B": 2, "Opsie C": 1},
+}
+
+
+# Default weights with any [ranking] settings laid over them
+def get_weights():
+    weights = {key: dict(value) for key, value in DEFAULT_WEIGHTS.items()}
+    for key, value in get_setting("ranking", {}).items():
+        weights[key] = dict(value)
+    return weights
+
+
+# p-points for every row at once: weighted marks plus status points, rounded to 2 places
+def compute_points(frame, weights):
+    points = pd.Series(0.0, index=frame.index)
+    for column, weight in weights["marks"].items():
+        if column in frame.columns:
+            points += pd.to_numeric(frame[column], errors="coerce").fillna(0) * weight
+    for column, values in weights.items():
+        if column != "marks" and column in frame.columns:
+            points += frame[column].map(values).astype(float).fillna(0)
+    return points.round(2)
+
+
+# p-points of a single record (dict keyed by column)
+def points_for(record, weights=None):
+    return float(compute_points(pd.DataFrame([record]), weights or get_weights()).iloc[0])
+
+
+# Recompute age and gender (from the ID), the average (from the marks) and, given
+# weights, the p-points for the whole roster in one pass. Returns
+# {studid: {column: new value}} for the students whose stored values are out of
+# date; IDs that cannot be parsed keep their stored age and gender.
+def recompute(frame, today=None, weights=None):
+    if frame.empty or "studid" not in frame.columns:
+        return {}
+
+    parsed = parse_ids(restore_ids(frame["studid"]), today)
+    valid = parsed["valid"]
+
+    stored_age = pd.to_numeric(frame["age"], errors="coerce")
+    age_changed = valid & (stored_age != parsed["age"]).fillna(True)
+
+    gender_changed = valid & (frame["gender"].astype(str) != parsed["gender"])
+
+    average = frame[MARK_COLUMNS].apply(pd.to_numeric, errors="coerce").mean(axis=1).round(2)
+    stored_average = pd.to_numeric(frame["average"], errors="coerce")
+    average_changed = average.notna() & ~np.isclose(stored_average, average, equal_nan=False)
+
+    columns = [
+        ("age", age_changed, parsed["age"]),
+        ("gender", gender_changed, parsed["gender"]),
+        ("average", average_changed, average),
+    ]
+
+    if weights is not None and "p-point" in frame.columns:
+        points = compute_points(frame, weights)
+        stored_points = pd.to_numeric(frame["p-point"], errors="coerce")
+        columns.append(("p-point", pd.Series(~np.isclose(stored_points, points), index=frame.index), points))
+
+    # Only the few changed rows are turned into Python values, keyed by the ID
+    # they were compared under so the changes cannot land on another student
+    studids = frame["studid"].astype(str).to_numpy()
+    changes = {}
+    for column, changed, values in columns:
+        for position in np.flatnonzero(changed.to_numpy()):
+            value = values.iloc[position]
+            changes.setdefault(studids[position], {})[column] = value.item() if hasattr(value, "item") else value
+    return changes
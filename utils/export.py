@@ -0,0 +1,153 @@
+# export.py
+
+import csv
+import os
+import tempfile
+import threading
+import uuid
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import streamlit as st
+from openpyxl import Workbook
+
+from utils.config import get_setting
+from utils.table import arrow_table
+
+# Supported formats: label -> (file extension, mime type)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+# Rows converted and written per step, so an export never holds the whole file in memory
+CHUNK_ROWS = 5000
+
+# How many finished export files are kept on disk
+DEFAULT_EXPORT_CACHE_SIZE = 16
+
+
+def _chunks(rows):
+    for start in range(0, len(rows), CHUNK_ROWS):
+        yield rows[start:start + CHUNK_ROWS]
+
+
+def _write_csv(frame, rows, path):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        csv.writer(file).writerow(frame.columns)
+        for chunk in _chunks(rows):
+            frame.iloc[chunk].to_csv(file, header=False, index=False)
+
+
+def _write_xlsx(frame, rows, path):
+    # Write-only workbooks stream rows to disk instead of building them in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Students")
+    sheet.append(frame.columns.tolist())
+    for chunk in _chunks(rows):
+        for row in frame.iloc[chunk].astype(object).itertuples(index=False):
+            sheet.append([None if pd.isna(value) else value for value in row])
+    workbook.save(path)
+
+
+def _write_parquet(frame, rows, path, version):
+    # Chunks are cut from the shared Arrow copy the tables already use
+    table = arrow_table(version, frame)
+    with pq.ParquetWriter(path, table.schema) as writer:
+        for chunk in _chunks(rows):
+            writer.write_table(table.take(chunk))
+
+
+# Finished export files on disk, keyed by (dataset version, view, format) and
+# evicted least recently used first. A file evicted while a session is still
+# reading it is removed once the last reader is done.
+class ExportCache:
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._files = OrderedDict()
+        self._readers = Counter()
+        self._evicted = set()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    # Must be called while holding the cache lock
+    def _evict(self):
+        while len(self._files) > self.max_entries:
+            old_key, old_path = self._files.popitem(last=False)
+            self._key_locks.pop(old_key, None)
+            if self._readers[old_path]:
+                self._evicted.add(old_path)
+            else:
+                os.remove(old_path)
+
+    # Claim the cached file of key for reading, or return None if there is none
+    def _open(self, key):
+        with self._lock:
+            path = self._files.get(key)
+            if path is not None:
+                self._files.move_to_end(key)
+                self._readers[path] += 1
+            return path
+
+    def _close(self, path):
+        with self._lock:
+            self._readers[path] -= 1
+            if not self._readers[path]:
+                del self._readers[path]
+                if path in self._evicted:
+                    self._evicted.discard(path)
+                    os.remove(path)
+
+    # Contents of the export for key, calling write(path) first if it is not cached
+    def read(self, key, write):
+        # Two sessions asking for the same export wait for one build
+        with self._key_lock(key):
+            path = self._open(key)
+            if path is None:
+                path = os.path.join(self.directory, f"{uuid.uuid4().hex}.{key[-1]}")
+                write(path + ".part")
+                os.replace(path + ".part", path)
+
+                with self._lock:
+                    self._files[key] = path
+                    self._readers[path] += 1
+                    self._evict()
+
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        finally:
+            self._close(path)
+
+
+@st.cache_resource
+def get_export_cache():
+    directory = tempfile.mkdtemp(prefix="studentload-exports-")
+    return ExportCache(directory, int(get_setting("export_cache_size", DEFAULT_EXPORT_CACHE_SIZE)))
+
+
+# Contents of an export of frame's rows (positions, in order) in one of
+# EXPORT_FORMATS. view identifies the rows (e.g. the filter state) so repeated
+# downloads of the same view and roster version are served from disk.
+def export_bytes(frame, version, rows, view, export_format):
+    extension = EXPORT_FORMATS[export_format][0]
+    rows = np.asarray(rows, dtype=np.int64)
+
+    def write(path):
+        if extension == "csv":
+            _write_csv(frame, rows, path)
+        elif extension == "xlsx":
+            _write_xlsx(frame, rows, path)
+        else:
+            _write_parquet(frame, rows, path, version)
+
+    return get_export_cache().read((version, view, extension), write)
@@ -0,0 +1,147 @@
+# filters.py
+
+import threading
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from utils import data
+from utils.config import get_setting
+from utils.tracing import span
+
+# Columns with a handful of repeated values, stored as categoricals
+CATEGORY_COLUMNS = ["gender", "school", "siblings", "sport", "culture", "leader"]
+
+# Whole-number columns, stored in the smallest integer type that fits
+INTEGER_COLUMNS = ["age", "maths", "english", "afrikaans"]
+
+# How many filter results each engine remembers
+DEFAULT_RESULT_CACHE_SIZE = 64
+
+
+# Copy of the roster with compact dtypes: categoricals for repeated text and
+# small integers for marks. Columns holding anything unexpected are left as is.
+def compact(frame):
+    frame = frame.copy()
+    for column in CATEGORY_COLUMNS:
+        if column in frame.columns:
+            frame[column] = frame[column].astype("category")
+    for column in INTEGER_COLUMNS:
+        if column in frame.columns:
+            numbers = pd.to_numeric(frame[column], errors="coerce")
+            if numbers.notna().all() and (numbers % 1 == 0).all():
+                frame[column] = pd.to_numeric(numbers, downcast="integer")
+    return frame
+
+
+# Answers the Filter page's school / average range / sort queries on one
+# version of the roster. Sort orders and per-school row bitmaps are built once,
+# and recent query results are kept in a small LRU.
+class FilterEngine:
+
+    def __init__(self, frame, version=None, cache_size=DEFAULT_RESULT_CACHE_SIZE):
+        self.frame = compact(frame)
+        self.version = version
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._results = OrderedDict()
+
+        # One boolean row bitmap per school
+        if "school" in self.frame.columns:
+            codes = self.frame["school"].cat.codes.to_numpy()
+            self.schools = self.frame["school"].cat.categories.tolist()
+            self._school_rows = {school: codes == code for code, school in enumerate(self.schools)}
+        else:
+            self.schools = []
+            self._school_rows = {}
+
+        average = pd.to_numeric(self.frame["average"], errors="coerce") if "average" in self.frame.columns else pd.Series(dtype=float)
+        self._average = average.to_numpy(dtype=float)
+        self.min_average = int(average.min()) if average.notna().any() else 0
+        self.max_average = int(average.max()) if average.notna().any() else 0
+
+        # Memory used by the compacted roster, measured once
+        self._frame_nbytes = int(self.frame.memory_usage(deep=True).sum())
+
+    # Memory used by the compacted roster and the orders, bitmaps and results built so far
+    @property
+    def nbytes(self):
+        arrays = [self._average, *self._school_rows.values(), *self._results.values()]
+        for present, missing in list(self._orders.values()):
+            arrays += [present, missing]
+        return self._frame_nbytes + sum(array.nbytes for array in arrays)
+
+    # Stable ascending order of a column as (rows with a value, rows without one)
+    def _order(self, column):
+        if column not in self._orders:
+            series = self.frame[column]
+            present = series.notna().to_numpy()
+            rows = np.flatnonzero(present)
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                keys = series.cat.codes.to_numpy()[present]
+            else:
+                keys = series.to_numpy()[present]
+            try:
+                order = rows[np.argsort(keys, kind="stable")]
+            except TypeError:
+                # Mixed text and numbers: fall back to comparing them as text
+                order = rows[np.argsort(keys.astype(str), kind="stable")]
+            self._orders[column] = (order, np.flatnonzero(~present))
+        return self._orders[column]
+
+    # Every row ordered by one column, rows without a value last
+    def sorted_rows(self, column, descending=False):
+        present, missing = self._order(column)
+        return np.concatenate([present[::-1] if descending else present, missing])
+
+    def _compute(self, schools, average_range, sort_column, sort_order):
+        # Filter the data based on selected schools (all schools if none selected)
+        if schools:
+            mask = np.zeros(len(self.frame), dtype=bool)
+            for school in schools:
+                mask |= self._school_rows.get(school, False)
+        else:
+            mask = np.ones(len(self.frame), dtype=bool)
+
+        # Further filter the data based on the average score range
+        mask &= (self._average >= average_range[0]) & (self._average <= average_range[1])
+
+        # Apply sorting by walking the precomputed order instead of sorting again
+        if sort_column in self.frame.columns and sort_order in ("Ascending", "Descending"):
+            order = self.sorted_rows(sort_column, sort_order == "Descending")
+            return order[mask[order]]
+        return np.flatnonzero(mask)
+
+    # Row positions matching a filter state, in display order
+    def query(self, schools, average_range, sort_column, sort_order):
+        key = (tuple(sorted(schools)), tuple(average_range), sort_column, sort_order)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+            with span("filter.query"):
+                positions = self._compute(schools, average_range, sort_column, sort_order)
+            self._results[key] = positions
+            if len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+            return positions
+
+    # The filtered, sorted rows themselves
+    def filter(self, schools, average_range, sort_column, sort_order):
+        return self.frame.iloc[self.query(schools, average_range, sort_column, sort_order)]
+
+
+def _build_engine(version, frame):
+    with span("filter.build_engine"):
+        return FilterEngine(frame, version, int(get_setting("filter_cache_size", DEFAULT_RESULT_CACHE_SIZE)))
+
+
+# Engine for a school's current roster, shared by every session of that school.
+# It is kept in the school's cache, so it counts toward its memory budget and is
+# dropped along with the roster version it was built from.
+def get_filter_engine(tenant=None):
+    version, frame = data.get_students_snapshot(tenant)
+    return data.derive(version, "filter_engine", partial(_build_engine, version, frame))
@@ -0,0 +1,115 @@
+# overview.py
+
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+from utils import data
+from utils.config import get_setting
+from utils.tenants import get_tenants
+
+
+def _numbers(frame, column):
+    if column not in frame.columns:
+        return pd.Series(dtype=float)
+    return pd.to_numeric(frame[column], errors="coerce").dropna()
+
+
+# A school's roster boiled down to a few numbers. Sums and counts are kept
+# instead of means so summaries of several schools can be added up.
+def summarize(frame):
+    average = _numbers(frame, "average")
+    points = _numbers(frame, "p-point")
+    gender = frame["gender"].astype(str) if "gender" in frame.columns else pd.Series(dtype=str)
+    return {
+        "students": len(frame),
+        "female": int((gender == "Female").sum()),
+        "male": int((gender == "Male").sum()),
+        "average_sum": float(average.sum()),
+        "average_count": len(average),
+        "average_min": float(average.min()) if len(average) else None,
+        "average_max": float(average.max()) if len(average) else None,
+        "points_sum": float(points.sum()),
+        "points_count": len(points),
+    }
+
+
+# Summaries of every school, tiny enough to keep after a school's roster has
+# been dropped from memory. A summary is reused while the roster version it was
+# made from is still cached, or for the cache TTL when the roster is not.
+class SummaryStore:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._summaries = {}
+
+    def get(self, code, version):
+        with self._lock:
+            entry = self._summaries.get(code)
+        if entry is None:
+            return None
+        summary_version, made_at, summary = entry
+        if version is not None:
+            return summary if version == summary_version else None
+        return summary if time.monotonic() - made_at < self.ttl else None
+
+    def put(self, code, version, summary):
+        with self._lock:
+            self._summaries[code] = (version, time.monotonic(), summary)
+
+
+@st.cache_resource
+def get_summary_store():
+    return SummaryStore(data.get_ttl())
+
+
+# Summary of one school, read from its replica when no usable summary is
+# stored, so looking at every school never loads their rosters into memory
+def summary_for(code):
+    store = get_summary_store()
+    version = data.cached_students_version(code)
+    summary = store.get(code, version)
+    if summary is None:
+        summary = summarize(data.read_students_replica(code))
+        store.put(code, version, summary)
+    return summary
+
+
+def _row(name, summary):
+    return {
+        "School": name,
+        "Students": summary["students"],
+        "Female": summary["female"],
+        "Male": summary["male"],
+        "Average": round(summary["average_sum"] / summary["average_count"], 2) if summary["average_count"] else None,
+        "Lowest Average": summary["average_min"],
+        "Highest Average": summary["average_max"],
+        "Mean p-points": round(summary["points_sum"] / summary["points_count"], 2) if summary["points_count"] else None,
+    }
+
+
+# One row per school plus a row for all schools together, added up from the
+# per-school summaries
+def cross_school_view():
+    tenants = get_tenants()
+    summaries = {code: summary_for(code) for code in tenants}
+    total = {
+        key: sum(summary[key] for summary in summaries.values())
+        for key in ("students", "female", "male", "average_sum", "average_count", "points_sum", "points_count")
+    }
+    minimums = [summary["average_min"] for summary in summaries.values() if summary["average_min"] is not None]
+    maximums = [summary["average_max"] for summary in summaries.values() if summary["average_max"] is not None]
+    total["average_min"] = min(minimums) if minimums else None
+    total["average_max"] = max(maximums) if maximums else None
+
+    rows = [_row(tenants[code].name, summary) for code, summary in summaries.items()]
+    rows.append(_row("All Schools", total))
+    return pd.DataFrame(rows)
+
+
+# Whether a user may see every school's figures, per the overview_users setting
+def can_view(username):
+    return bool(username) and username in get_setting("overview_users", [])
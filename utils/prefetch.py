@@ -0,0 +1,65 @@
+# prefetch.py
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import streamlit as st
+
+from utils import data, filters, ranking, search, statistics
+from utils.tenants import get_tenant
+
+logger = logging.getLogger(__name__)
+
+
+# Runs named warm-up jobs on background threads. A job that is still running is
+# not started again, so every session opening the login page shares one download.
+class Prefetcher:
+
+    def __init__(self, workers=2):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, name, func):
+        with self._lock:
+            future = self._jobs.get(name)
+            if future is None or future.done():
+                future = self._pool.submit(self._run, name, func)
+                self._jobs[name] = future
+            return future
+
+    def _run(self, name, func):
+        try:
+            func()
+        except Exception:
+            # The page will load the data itself and show the error there
+            logger.exception("Prefetching %s failed", name)
+
+
+@st.cache_resource
+def get_prefetcher():
+    return Prefetcher()
+
+
+# Everything the first pages read: the roster plus the filter engine, ranking
+# and statistics built from it
+def _warm_students(tenant):
+    data.get_students_snapshot(tenant)
+    filters.get_filter_engine(tenant)
+    ranking.get_ranking(tenant)
+    statistics.get_stats(tenant)
+    search.get_search_index(tenant)
+
+
+# Start downloading one school's Users and Students worksheets side by side,
+# skipping whatever is already cached. Returns immediately. Other schools'
+# worksheets are left alone.
+def start(tenant=None):
+    code = get_tenant(tenant).code
+    prefetcher = get_prefetcher()
+    if not data.users_ready(code):
+        prefetcher.submit(f"users {code}", partial(data.get_users, code))
+    if not data.students_ready(code):
+        prefetcher.submit(f"students {code}", partial(_warm_students, code))
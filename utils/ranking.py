@@ -0,0 +1,103 @@
+# ranking.py
+
+import bisect
+import threading
+
+import pandas as pd
+import streamlit as st
+
+from utils import data
+from utils.derived import DEFAULT_WEIGHTS, compute_points, get_weights, points_for
+from utils.tenants import get_tenant
+
+# Columns a student's score and grouping depend on, plus their name for display
+RANKING_COLUMNS = ["studid", "name", "surname", "school", "gender"] + list(DEFAULT_WEIGHTS["marks"]) + [column for column in DEFAULT_WEIGHTS if column != "marks"]
+
+
+# Students ordered by p-points, highest first (ties by student ID). Built once
+# from the whole roster, then kept up to date one student at a time as the app
+# creates, edits and deletes records.
+class Ranking:
+
+    def __init__(self, weights):
+        self.weights = weights
+        self._lock = threading.Lock()
+        self._keys = []
+        self._students = {}
+
+    def rebuild(self, frame):
+        columns = [column for column in RANKING_COLUMNS if column in frame.columns]
+        students = frame[columns].astype(object).assign(points=compute_points(frame, self.weights))
+        with self._lock:
+            self._students = {str(record["studid"]): record for record in students.to_dict("records")}
+            self._keys = sorted(self._key(studid) for studid in self._students)
+
+    def _key(self, studid):
+        return (-self._students[studid]["points"], studid)
+
+    def _remove(self, studid):
+        if studid in self._students:
+            key = self._key(studid)
+            position = bisect.bisect_left(self._keys, key)
+            if position < len(self._keys) and self._keys[position] == key:
+                del self._keys[position]
+            del self._students[studid]
+
+    # Apply changed values to a student (or add one), recompute their points and
+    # move them to their new place
+    def upsert(self, studid, changes):
+        studid = str(studid)
+        with self._lock:
+            merged = dict(self._students.get(studid, {"studid": studid}))
+            merged.update({column: value for column, value in changes.items() if column in RANKING_COLUMNS})
+            self._remove(studid)
+            merged["points"] = points_for(merged, self.weights)
+            self._students[studid] = merged
+            bisect.insort(self._keys, self._key(studid))
+
+    def remove(self, studid):
+        with self._lock:
+            self._remove(str(studid))
+
+    # 1-based rank of a student, or None if unknown
+    def rank_of(self, studid):
+        with self._lock:
+            if studid not in self._students:
+                return None
+            return bisect.bisect_left(self._keys, self._key(studid)) + 1
+
+    def __len__(self):
+        return len(self._keys)
+
+    # The k best students, optionally only those whose column equals value (e.g.
+    # school or gender). Walks the ranked order and stops after k matches.
+    def top(self, k, column=None, value=None):
+        result = []
+        with self._lock:
+            for rank, (_, studid) in enumerate(self._keys, start=1):
+                student = self._students[studid]
+                if column is None or student.get(column) == value:
+                    result.append({"rank": rank, **student})
+                    if len(result) == k:
+                        break
+        return pd.DataFrame(result)
+
+
+# One ranking per school and process, kept up to date by the data layer
+class RankingService(data.RosterService):
+
+    def __init__(self, tenant):
+        super().__init__(tenant, lambda: Ranking(get_weights()))
+
+
+@st.cache_resource
+def _ranking_service(code):
+    return RankingService(code)
+
+
+def get_ranking_service(tenant=None):
+    return _ranking_service(get_tenant(tenant).code)
+
+
+def get_ranking(tenant=None):
+    return get_ranking_service(tenant).get()
@@ -0,0 +1,212 @@
+# replica.py
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+from gspread.utils import numericise_all
+
+from utils.config import get_setting
+from utils.storage import get_storage
+from utils.tenants import get_tenant
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Default location of the local replicas (one file per school, named after it)
+# and how often they are synced with the sheet, normally and while nobody uses the school
+DEFAULT_PATH = os.path.join(".cache", "replica.sqlite")
+DEFAULT_SYNC_INTERVAL = 60
+DEFAULT_IDLE_SYNC_INTERVAL = 600
+
+
+# Hash of one row's values, used to detect which rows changed since the last sync
+def row_hash(values):
+    return hashlib.blake2b(json.dumps(values, default=str).encode('utf-8'), digest_size=8).hexdigest()
+
+
+# Local SQLite copy of a worksheet. Pages read from it, writes go through to the
+# storage backend and are applied here too, and a background thread pulls in edits made
+# elsewhere by comparing row hashes and rewriting only the rows that changed.
+class Replica:
+
+    def __init__(self, storage, name, path, sync_interval, idle_sync_interval=DEFAULT_IDLE_SYNC_INTERVAL):
+        self.storage = storage
+        self.name = name
+        self.sync_interval = sync_interval
+        self.idle_sync_interval = idle_sync_interval
+        self.last_sync = None
+        self._listeners = []
+        self._after_sync = []
+        self._is_idle = None
+        self._lock = threading.Lock()
+        # Bumped by every write-through so a sync that raced a write can be discarded
+        self._generation = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rows (position INTEGER PRIMARY KEY, hash TEXT, data TEXT)")
+        self._conn.commit()
+
+    # Call func() whenever a sync changed the replica
+    def on_change(self, func):
+        self._listeners.append(func)
+
+    # Call func() after every successful background sync, changed or not
+    def after_sync(self, func):
+        self._after_sync.append(func)
+
+    # Sync in the background only every idle_sync_interval seconds while func() is true
+    def idle_when(self, func):
+        self._is_idle = func
+
+    def _get_header(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'header'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def is_empty(self):
+        with self._lock:
+            return self._get_header() is None
+
+    # Read the whole replica into a DataFrame ordered like the sheet
+    def read_frame(self):
+        with self._lock:
+            header = self._get_header() or []
+            rows = self._conn.execute("SELECT data FROM rows ORDER BY position").fetchall()
+
+        # Parse all rows in one go; much faster than one json.loads per row
+        with span("replica.build_frame"):
+            values = json.loads("[" + ",".join(row[0] for row in rows) + "]")
+            return pd.DataFrame(values, columns=header)
+
+    # Download the worksheet and apply only the rows whose hash changed.
+    # Returns the number of rows written, inserted or removed.
+    def sync(self):
+        with self._lock:
+            generation = self._generation
+
+        values = self.storage.read_all(self.name)
+        header = values[0] if values else []
+        # Same conversion get_all_records applies, so types match the old pages
+        rows = [numericise_all(row) for row in values[1:]]
+        hashes = [row_hash(row) for row in rows]
+
+        with self._lock:
+            # A write went through while we were downloading; our copy is older than
+            # the replica, so skip this round and let the next sync pick it up
+            if generation != self._generation:
+                return 0
+
+            if header != self._get_header():
+                self._conn.execute("DELETE FROM rows")
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('header', ?)", (json.dumps(header),))
+                known = {}
+            else:
+                known = dict(self._conn.execute("SELECT position, hash FROM rows"))
+
+            updates = [
+                (position, digest, json.dumps(row, default=str))
+                for position, (row, digest) in enumerate(zip(rows, hashes), start=2)
+                if known.get(position) != digest
+            ]
+            self._conn.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)", updates)
+            removed = self._conn.execute("DELETE FROM rows WHERE position > ?", (len(rows) + 1,)).rowcount
+            self._conn.commit()
+            changed = len(updates) + removed
+            self.last_sync = time.time()
+
+        if changed:
+            for func in self._listeners:
+                func()
+        return changed
+
+    # Record rows appended to the sheet at first_row. Returns False if they did not
+    # land right after the replica's last row, in which case a sync is needed.
+    def append(self, first_row, rows):
+        with self._lock:
+            self._generation += 1
+            count = self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+            if first_row != count + 2:
+                return False
+            self._conn.executemany(
+                "INSERT INTO rows VALUES (?, ?, ?)",
+                [(first_row + i, row_hash(row), json.dumps(row, default=str)) for i, row in enumerate(rows)]
+            )
+            self._conn.commit()
+            return True
+
+    # Record changed cells ({column number: value}) of one sheet row
+    def update(self, row, values):
+        self.update_many({row: values})
+
+    # Record changed cells of several sheet rows ({row: {column number: value}})
+    def update_many(self, updates):
+        with self._lock:
+            self._generation += 1
+            for row, values in updates.items():
+                found = self._conn.execute("SELECT data FROM rows WHERE position = ?", (row,)).fetchone()
+                if found is None:
+                    continue
+                data = json.loads(found[0])
+                for col, value in values.items():
+                    data[col - 1] = value
+                self._conn.execute("UPDATE rows SET hash = ?, data = ? WHERE position = ?", (row_hash(data), json.dumps(data, default=str), row))
+            self._conn.commit()
+
+    # Record a deleted sheet row; the rows below it move up by one
+    def delete(self, row):
+        with self._lock:
+            self._generation += 1
+            self._conn.execute("DELETE FROM rows WHERE position = ?", (row,))
+            # Shift through negative positions so the primary key never collides mid-update
+            self._conn.execute("UPDATE rows SET position = 1 - position WHERE position > ?", (row,))
+            self._conn.execute("UPDATE rows SET position = -position WHERE position < 0")
+            self._conn.commit()
+
+    # Keep syncing in the background; Sheets errors are logged and the replica keeps serving
+    def _run(self):
+        synced_at = time.monotonic()
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                if self._is_idle is not None and self._is_idle() and time.monotonic() - synced_at < self.idle_sync_interval:
+                    continue
+                synced_at = time.monotonic()
+                self.sync()
+                for func in self._after_sync:
+                    func()
+            except Exception:
+                logger.exception("Sync of %s failed", self.name)
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"replica-sync-{self.name}", daemon=True).start()
+
+
+# One replica per school and process, synced once up front if it has never been filled
+@st.cache_resource
+def get_replica(tenant=None):
+    tenant = get_tenant(tenant)
+    config = get_setting("replica", {})
+    path = config.get("path", DEFAULT_PATH)
+    if path != ":memory:":
+        base, extension = os.path.splitext(path)
+        path = f"{base}_{tenant.code}{extension}"
+    replica = Replica(
+        get_storage(tenant.spreadsheet),
+        tenant.students_sheet,
+        path,
+        int(config.get("sync_interval", DEFAULT_SYNC_INTERVAL)),
+        int(config.get("idle_sync_interval", DEFAULT_IDLE_SYNC_INTERVAL)),
+    )
+    if replica.is_empty():
+        replica.sync()
+    replica.start()
+    return replica
@@ -0,0 +1,212 @@
+# search.py
+
+import bisect
+import re
+import threading
+from collections import Counter
+
+import streamlit as st
+
+from utils import data
+from utils.tenants import get_tenant
+
+# Columns searched, in the order results show them
+SEARCH_COLUMNS = ["studid", "name", "midlename", "surname"]
+
+# How many results a search returns unless asked for more
+DEFAULT_LIMIT = 20
+
+# Scores of the ways a query word can match a word of a student
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.8
+NGRAM_SCORE = 0.6
+TYPO_SCORE = 0.5
+
+# Most words a prefix or substring of a query word expands to
+MAX_EXPANSIONS = 200
+
+# Share of trigrams a word must have in common with the query word before the
+# (slower) edit distance is worked out
+TYPO_MIN_OVERLAP = 0.3
+
+
+def _words(text):
+    return re.findall(r"\w+", str(text).lower())
+
+
+def _trigrams(word):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Levenshtein distance, or limit + 1 as soon as it is certain to exceed limit
+def _distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+# Word index over the searched columns of one roster. Words are kept in a
+# sorted list for prefix lookups and in a trigram index for substring and
+# typo-tolerant lookups; each word points at the students that have it.
+class SearchIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._students = {}
+        self._postings = {}
+        self._words = []
+        self._trigrams = {}
+
+    def __len__(self):
+        return len(self._students)
+
+    def _student_words(self, fields):
+        words = set()
+        for column in SEARCH_COLUMNS:
+            words.update(_words(fields.get(column, "")))
+        return words
+
+    def _add(self, studid, fields):
+        self._students[studid] = fields
+        for word in self._student_words(fields):
+            students = self._postings.get(word)
+            if students is None:
+                students = self._postings[word] = set()
+                bisect.insort(self._words, word)
+                for trigram in _trigrams(word):
+                    self._trigrams.setdefault(trigram, set()).add(word)
+            students.add(studid)
+
+    def _remove(self, studid):
+        fields = self._students.pop(studid, None)
+        if fields is None:
+            return
+        for word in self._student_words(fields):
+            students = self._postings[word]
+            students.discard(studid)
+            if not students:
+                del self._postings[word]
+                del self._words[bisect.bisect_left(self._words, word)]
+                for trigram in _trigrams(word):
+                    self._trigrams[trigram].discard(word)
+
+    def rebuild(self, frame):
+        columns = [column for column in SEARCH_COLUMNS if column in frame.columns]
+        with self._lock:
+            self._reset()
+            for record in frame[columns].astype(str).to_dict("records"):
+                self._add(record[data.KEY_COLUMN], record)
+
+    # Add a student, or apply changed names to one already indexed
+    def upsert(self, studid, changes):
+        studid = str(studid)
+        with self._lock:
+            fields = dict(self._students.get(studid, {data.KEY_COLUMN: studid}))
+            fields.update({column: str(value) for column, value in changes.items() if column in SEARCH_COLUMNS})
+            self._remove(studid)
+            self._add(studid, fields)
+
+    def remove(self, studid):
+        with self._lock:
+            self._remove(str(studid))
+
+    # Best score of every indexed word matching one query word: the word itself,
+    # words starting with it, words containing it, and words one or two typos away.
+    # Prefix and substring matches stop at MAX_EXPANSIONS words each, so a short
+    # query or the shared leading digits of IDs do not pull in the whole roster.
+    def _match_word(self, query):
+        scores = {}
+        if query in self._postings:
+            scores[query] = EXACT_SCORE
+
+        position = bisect.bisect_left(self._words, query)
+        end = min(len(self._words), position + MAX_EXPANSIONS)
+        while position < end and self._words[position].startswith(query):
+            word = self._words[position]
+            scores.setdefault(word, PREFIX_SCORE + 0.2 * len(query) / len(word))
+            position += 1
+
+        if len(query) < 3:
+            return scores
+
+        # Every word containing the query has all of its trigrams, so the words of
+        # its rarest trigram are the only candidates
+        inner = [self._trigrams.get(query[i:i + 3], set()) for i in range(len(query) - 2)]
+        found = 0
+        for word in min(inner, key=len):
+            if found == MAX_EXPANSIONS:
+                break
+            if word not in scores and query in word:
+                scores[word] = NGRAM_SCORE
+                found += 1
+
+        # A mistyped digit gives another student's ID, so IDs are not typo-tolerant
+        if query.isdigit():
+            return scores
+
+        query_trigrams = _trigrams(query)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        limit = 1 if len(query) < 6 else 2
+        for word, count in shared.items():
+            # A word has at most len(word) trigrams
+            if word in scores or count / (len(query_trigrams) + len(word) - count) < TYPO_MIN_OVERLAP:
+                continue
+            distance = _distance(query, word, limit)
+            if distance <= limit:
+                scores[word] = TYPO_SCORE / distance
+        return scores
+
+    # Students matching every word of the query, best first, as dicts of the
+    # searched columns plus a score. IDs may be typed with their leading zeros.
+    def search(self, query, limit=DEFAULT_LIMIT):
+        words = [word.lstrip("0") or word if word.isdigit() else word for word in _words(query)]
+        if not words:
+            return []
+
+        with self._lock:
+            totals = None
+            for word in words:
+                best = {}
+                for match, score in self._match_word(word).items():
+                    for studid in self._postings[match]:
+                        if score > best.get(studid, 0):
+                            best[studid] = score
+                if totals is None:
+                    totals = best
+                else:
+                    totals = {studid: total + best[studid] for studid, total in totals.items() if studid in best}
+                if not totals:
+                    return []
+
+            ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            return [{**self._students[studid], "score": round(score, 3)} for studid, score in ranked]
+
+
+# A school's search index, kept up to date by the data layer
+class SearchService(data.RosterService):
+
+    def __init__(self, tenant):
+        super().__init__(tenant, SearchIndex)
+
+
+@st.cache_resource
+def _search_service(code):
+    return SearchService(code)
+
+
+def get_search_index(tenant=None):
+    return _search_service(get_tenant(tenant).code).get()
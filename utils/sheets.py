@@ -0,0 +1,88 @@
+# sheets.py
+
+import re
+
+import gspread
+import streamlit as st
+from gspread.utils import ValueRenderOption, numericise, rowcol_to_a1
+from oauth2client.service_account import ServiceAccountCredentials
+
+from utils.tracing import sheets_call, span
+
+# Spreadsheet holding the worksheets of every school without one of its own
+SPREADSHEET_NAME = "Entry_Form"
+
+
+# Authorize once per process and share the client between all sessions
+@st.cache_resource
+def get_client():
+    # Access secrets from Streamlit
+    credentials_dict = st.secrets["google_api"]
+
+    # Use the dictionary directly with gspread
+    with span("sheets.authorize"):
+        credentials = ServiceAccountCredentials.from_json_keyfile_dict(credentials_dict)
+        return gspread.authorize(credentials)
+
+
+# Open a worksheet once per process instead of on every rerun
+@st.cache_resource
+def get_worksheet(name, spreadsheet=SPREADSHEET_NAME):
+    client = get_client()
+    # Opening fetches the spreadsheet metadata, then the worksheet lookup fetches it again
+    with sheets_call("read", "open", count=2):
+        return client.open(spreadsheet).worksheet(name)
+
+
+# Append rows below the last row of a worksheet in a single API call and
+# return the sheet row number assigned to the first appended row
+def append_rows(name, rows, spreadsheet=SPREADSHEET_NAME):
+    worksheet = get_worksheet(name, spreadsheet)
+    with sheets_call("write", "append_rows"):
+        response = worksheet.append_rows(rows, table_range="A1")
+
+    # The response reports the written range, e.g. "Students_HGH!A12:P14"
+    updated_range = response["updates"]["updatedRange"]
+    return int(re.search(r"![A-Z]+(\d+)", updated_range).group(1))
+
+
+# Read a single cell as a string, converted the same way get_all_records converts values
+def read_cell(name, row, col, spreadsheet=SPREADSHEET_NAME):
+    worksheet = get_worksheet(name, spreadsheet)
+    with sheets_call("read", "read_cell"):
+        cell = worksheet.cell(row, col, value_render_option=ValueRenderOption.unformatted)
+    return str(numericise(cell.value)) if cell.value is not None else None
+
+
+# Write cells of one or more rows ({row: {column number: value}}) in a single API call
+def update_cells(name, updates, spreadsheet=SPREADSHEET_NAME):
+    data = [
+        {"range": rowcol_to_a1(row, col), "values": [[value]]}
+        for row, values in updates.items()
+        for col, value in values.items()
+    ]
+    worksheet = get_worksheet(name, spreadsheet)
+    with sheets_call("write", "update_cells"):
+        worksheet.batch_update(data)
+
+
+# Delete a row by its sheet row number
+def delete_row(name, row, spreadsheet=SPREADSHEET_NAME):
+    worksheet = get_worksheet(name, spreadsheet)
+    with sheets_call("write", "delete_row"):
+        worksheet.delete_rows(row)
+
+
+# Download every value of a worksheet, header row included, in one API call
+def read_all_values(name, spreadsheet=SPREADSHEET_NAME):
+    worksheet = get_worksheet(name, spreadsheet)
+    with sheets_call("read", "read_all_values"):
+        return worksheet.get_all_values()
+
+
+# Return the row whose first column holds key, or None if there is none
+def find_row(name, key, spreadsheet=SPREADSHEET_NAME):
+    worksheet = get_worksheet(name, spreadsheet)
+    with sheets_call("read", "find_row"):
+        cell = worksheet.find(str(key), in_column=1)
+    return cell.row if cell else None
@@ -0,0 +1,178 @@
+# statistics.py
+
+import threading
+from collections import Counter
+
+import pandas as pd
+import streamlit as st
+
+from utils import data
+from utils.tenants import get_tenant
+
+# Columns counted value by value
+COUNT_COLUMNS = ["school", "gender", "age"]
+
+# Subject marks, also kept as histograms
+MARK_COLUMNS = ["maths", "english", "afrikaans"]
+
+# Columns with running min / max / mean
+NUMBER_COLUMNS = MARK_COLUMNS + ["average", "p-point"]
+
+TRACKED_COLUMNS = list(dict.fromkeys(COUNT_COLUMNS + NUMBER_COLUMNS))
+
+# Width of a histogram bin; the last bin also holds 100
+BIN_WIDTH = 10
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if number != number else number
+
+
+def _bin(mark):
+    start = min(max(int(mark // BIN_WIDTH) * BIN_WIDTH, 0), 100 - BIN_WIDTH)
+    return f"{start}-{start + BIN_WIDTH - 1}" if start < 100 - BIN_WIDTH else f"{start}-100"
+
+
+# Count, sum, min and max of a column that values can be added to and removed
+# from. Min and max are only searched again when the current extreme is removed.
+class RunningStat:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self._values = Counter()
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self._values[value] += 1
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def remove(self, value):
+        self.count -= 1
+        self.total -= value
+        self._values[value] -= 1
+        if self._values[value] == 0:
+            del self._values[value]
+            if value == self.minimum:
+                self.minimum = min(self._values, default=None)
+            if value == self.maximum:
+                self.maximum = max(self._values, default=None)
+
+    @property
+    def mean(self):
+        return round(self.total / self.count, 2) if self.count else None
+
+
+# Counts, histograms and running statistics of one roster. Each student's
+# tracked values are remembered so an update or delete can take back exactly
+# what the student contributed.
+class RosterStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._students = {}
+        self.counts = {column: Counter() for column in COUNT_COLUMNS}
+        self.histograms = {column: Counter() for column in MARK_COLUMNS}
+        self.numbers = {column: RunningStat() for column in NUMBER_COLUMNS}
+
+    def __len__(self):
+        return len(self._students)
+
+    def _add(self, values):
+        for column in COUNT_COLUMNS:
+            if values.get(column) not in (None, ""):
+                self.counts[column][values[column]] += 1
+        for column in NUMBER_COLUMNS:
+            number = _number(values.get(column))
+            if number is not None:
+                self.numbers[column].add(number)
+                if column in self.histograms:
+                    self.histograms[column][_bin(number)] += 1
+
+    def _remove(self, values):
+        for column in COUNT_COLUMNS:
+            if values.get(column) not in (None, ""):
+                self.counts[column][values[column]] -= 1
+                if self.counts[column][values[column]] <= 0:
+                    del self.counts[column][values[column]]
+        for column in NUMBER_COLUMNS:
+            number = _number(values.get(column))
+            if number is not None:
+                self.numbers[column].remove(number)
+                if column in self.histograms:
+                    self.histograms[column][_bin(number)] -= 1
+
+    def rebuild(self, frame):
+        columns = [column for column in [data.KEY_COLUMN] + TRACKED_COLUMNS if column in frame.columns]
+        with self._lock:
+            self._reset()
+            for record in frame[columns].astype(object).to_dict("records"):
+                values = {column: record.get(column) for column in TRACKED_COLUMNS}
+                self._students[str(record[data.KEY_COLUMN])] = values
+                self._add(values)
+
+    # Add a student, or apply changed values to one already counted
+    def upsert(self, studid, changes):
+        studid = str(studid)
+        with self._lock:
+            old = self._students.get(studid)
+            if old is not None:
+                self._remove(old)
+            values = dict(old or {})
+            values.update({column: value for column, value in changes.items() if column in TRACKED_COLUMNS})
+            self._students[studid] = values
+            self._add(values)
+
+    def remove(self, studid):
+        with self._lock:
+            old = self._students.pop(str(studid), None)
+            if old is not None:
+                self._remove(old)
+
+    # Everything the dashboard shows, copied out under the lock. Its size depends
+    # on the number of distinct values and bins, not on the number of students.
+    def summary(self):
+        with self._lock:
+            return {
+                "students": len(self._students),
+                "counts": {column: dict(counter) for column, counter in self.counts.items()},
+                "histograms": {column: dict(counter) for column, counter in self.histograms.items()},
+                "numbers": {
+                    column: {"min": stat.minimum, "max": stat.maximum, "mean": stat.mean, "count": stat.count}
+                    for column, stat in self.numbers.items()
+                },
+            }
+
+
+# A school's statistics, kept up to date by the data layer
+class StatsService(data.RosterService):
+
+    def __init__(self, tenant):
+        super().__init__(tenant, RosterStats)
+
+
+@st.cache_resource
+def _stats_service(code):
+    return StatsService(code)
+
+
+def get_stats(tenant=None):
+    return _stats_service(get_tenant(tenant).code).get()
+
+
+# A count dictionary as a Series sorted by its keys (numbers before text), ready
+# for st.bar_chart
+def as_series(counts, name):
+    keys = sorted(counts, key=lambda key: (isinstance(key, str), key))
+    return pd.Series([counts[key] for key in keys], index=[str(key) for key in keys], name=name, dtype="int64")
@@ -0,0 +1,162 @@
+# storage.py
+
+import os
+import threading
+from abc import ABC, abstractmethod
+
+import pandas as pd
+import streamlit as st
+from gspread.exceptions import APIError
+from gspread.utils import numericise
+
+from utils import sheets
+from utils.config import get_setting
+
+
+# Operations the app needs from wherever the worksheets are stored. Rows are
+# numbered like in Google Sheets: row 1 is the header, data starts at row 2.
+# A backend missing one of them fails when it is created, not mid-write.
+class Storage(ABC):
+
+    # Every value of a worksheet as strings, header row first
+    @abstractmethod
+    def read_all(self, name):
+        raise NotImplementedError
+
+    # Append rows in one call and return the row number of the first one
+    @abstractmethod
+    def append(self, name, rows):
+        raise NotImplementedError
+
+    # Overwrite cells of several rows ({row: {column number: value}}) in one call
+    @abstractmethod
+    def update_rows(self, name, updates):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_row(self, name, row):
+        raise NotImplementedError
+
+    # Return the row whose first column holds key, or None
+    @abstractmethod
+    def find_row(self, name, key):
+        raise NotImplementedError
+
+    # Return the key (first column) stored at a row, or None past the last row
+    @abstractmethod
+    def key_at(self, name, row):
+        raise NotImplementedError
+
+    # Whether an error means the backend is rate limiting us and the call may be retried
+    def is_quota_error(self, error):
+        return False
+
+
+# The live Google Sheet: worksheets of one spreadsheet
+class SheetsStorage(Storage):
+
+    def __init__(self, spreadsheet=sheets.SPREADSHEET_NAME):
+        self.spreadsheet = spreadsheet
+
+    def read_all(self, name):
+        return sheets.read_all_values(name, self.spreadsheet)
+
+    def append(self, name, rows):
+        return sheets.append_rows(name, rows, self.spreadsheet)
+
+    def update_rows(self, name, updates):
+        sheets.update_cells(name, updates, self.spreadsheet)
+
+    def delete_row(self, name, row):
+        sheets.delete_row(name, row, self.spreadsheet)
+
+    def find_row(self, name, key):
+        return sheets.find_row(name, key, self.spreadsheet)
+
+    def key_at(self, name, row):
+        return sheets.read_cell(name, row, 1, self.spreadsheet)
+
+    # Google answers 429 once the per-minute quota is used up
+    def is_quota_error(self, error):
+        return isinstance(error, APIError) and error.code == 429
+
+
+# Keys are compared the way get_all_records converts values, like SheetsStorage does
+def _key(value):
+    return str(numericise(str(value)))
+
+
+# Worksheets held in memory, for running and profiling the app without network
+# access. Each worksheet can be seeded from "<name>.csv" in seed_dir.
+class LocalStorage(Storage):
+
+    def __init__(self, tables=None, seed_dir=None):
+        self._lock = threading.Lock()
+        self._tables = {name: [list(row) for row in rows] for name, rows in (tables or {}).items()}
+        self.seed_dir = seed_dir
+
+    def _table(self, name):
+        if name not in self._tables:
+            path = os.path.join(self.seed_dir, f"{name}.csv") if self.seed_dir else None
+            if path and os.path.exists(path):
+                seed = pd.read_csv(path, dtype=str, keep_default_na=False)
+                self._tables[name] = [seed.columns.tolist()] + seed.values.tolist()
+            else:
+                self._tables[name] = []
+        return self._tables[name]
+
+    # Values come back as strings, like the Sheets API returns them
+    def read_all(self, name):
+        with self._lock:
+            return [[str(value) for value in row] for row in self._table(name)]
+
+    def append(self, name, rows):
+        with self._lock:
+            table = self._table(name)
+            first_row = len(table) + 1
+            table.extend(list(row) for row in rows)
+            return first_row
+
+    def update_rows(self, name, updates):
+        with self._lock:
+            table = self._table(name)
+            for row, values in updates.items():
+                cells = table[row - 1]
+                for col, value in values.items():
+                    cells.extend([""] * (col - len(cells)))
+                    cells[col - 1] = value
+
+    def delete_row(self, name, row):
+        with self._lock:
+            del self._table(name)[row - 1]
+
+    def find_row(self, name, key):
+        with self._lock:
+            for position, cells in enumerate(self._table(name), start=1):
+                if position > 1 and cells and _key(cells[0]) == str(key):
+                    return position
+        return None
+
+    def key_at(self, name, row):
+        with self._lock:
+            table = self._table(name)
+            return _key(table[row - 1][0]) if 1 < row <= len(table) else None
+
+
+# Build the backend chosen by the [storage] secrets, e.g.
+#   [storage]
+#   backend = "local"
+#   seed_dir = "rosters"
+def create_storage(config, spreadsheet=sheets.SPREADSHEET_NAME):
+    backend = config.get("backend", "sheets")
+    if backend == "sheets":
+        return SheetsStorage(spreadsheet)
+    if backend == "local":
+        return LocalStorage(seed_dir=config.get("seed_dir"))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+# One backend per spreadsheet and process, shared by every session
+@st.cache_resource
+def get_storage(spreadsheet=sheets.SPREADSHEET_NAME):
+    return create_storage(get_setting("storage", {}), spreadsheet)
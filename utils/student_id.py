@@ -0,0 +1,92 @@
+# student_id.py
+
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+ID_LENGTH = 13
+
+
+# Split well-formed IDs into a (rows, 13) matrix of digits without any Python loop
+def _digit_matrix(ids):
+    if len(ids) == 0:
+        return np.zeros((0, ID_LENGTH), dtype=np.int64)
+    buffer = "".join(ids.tolist()).encode("ascii")
+    return (np.frombuffer(buffer, dtype=np.uint8).reshape(-1, ID_LENGTH) - ord("0")).astype(np.int64)
+
+
+# Luhn check over the whole matrix: moving left from the check digit, every
+# second digit is doubled (minus 9 when above 9) and the sum must end in 0
+def _luhn_valid(digits):
+    doubled = digits[:, 1::2] * 2
+    doubled = np.where(doubled > 9, doubled - 9, doubled)
+    total = digits[:, 0::2].sum(axis=1) + doubled.sum(axis=1)
+    return total % 10 == 0
+
+
+# Derive birth date, age and gender from 13-digit IDs (YYMMDD G SSS C A Z) for a
+# whole Series at once. Returns a DataFrame aligned with ids holding 'valid',
+# 'birth_date', 'age' and 'gender'. An ID is valid when it has 13 digits, a real
+# birth date that is not in the future and a correct Luhn check digit; rows that
+# are not valid have missing values.
+def parse_ids(ids, today=None):
+    today = today or date.today()
+    ids = ids.astype(str).str.strip()
+
+    # Thirteen ASCII digits, nothing else
+    well_formed = ids.str.fullmatch(r"[0-9]{13}").fillna(False).to_numpy(dtype=bool)
+    digits = _digit_matrix(ids.where(well_formed, "0" * ID_LENGTH))
+
+    # Extract birth date from ID (YYMMDD format)
+    birth_year = digits[:, 0] * 10 + digits[:, 1]
+    birth_month = digits[:, 2] * 10 + digits[:, 3]
+    birth_day = digits[:, 4] * 10 + digits[:, 5]
+
+    # Century rule: two-digit years after this year's belong to the 1900s
+    birth_year = birth_year + np.where(birth_year > today.year % 100, 1900, 2000)
+
+    # A date is real when the day fits inside its month
+    month_valid = (birth_month >= 1) & (birth_month <= 12)
+    month_start = (
+        (birth_year - 1970).astype("datetime64[Y]").astype("datetime64[M]")
+        + (np.clip(birth_month, 1, 12) - 1).astype("timedelta64[M]")
+    )
+    days_in_month = ((month_start + np.timedelta64(1, "M")).astype("datetime64[D]") - month_start.astype("datetime64[D]")).astype(int)
+    day_valid = (birth_day >= 1) & (birth_day <= days_in_month)
+    birth_date = month_start.astype("datetime64[D]") + (np.clip(birth_day, 1, None) - 1).astype("timedelta64[D]")
+
+    valid = well_formed & month_valid & day_valid & _luhn_valid(digits) & (birth_date <= np.datetime64(today))
+
+    # Calculate age, one year less if the birthday is still to come this year
+    birthday_pending = (birth_month > today.month) | ((birth_month == today.month) & (birth_day > today.day))
+    age = today.year - birth_year - birthday_pending
+
+    # Determine gender based on the 7th digit
+    gender = np.where(digits[:, 6] >= 5, "Male", "Female")
+
+    return pd.DataFrame({
+        "valid": valid,
+        "birth_date": pd.Series(birth_date, index=ids.index).where(valid),
+        "age": pd.Series(age, index=ids.index).where(valid).astype("Int64"),
+        "gender": pd.Series(gender, index=ids.index).where(valid),
+    }, index=ids.index)
+
+
+# Single-ID version for forms: (age, gender), or (None, None) if the ID is not valid
+def parse_id(student_id, today=None):
+    parsed = parse_ids(pd.Series([student_id]), today).iloc[0]
+    if not parsed["valid"]:
+        return None, None
+    return int(parsed["age"]), parsed["gender"]
+
+
+# IDs as they appear in the cached roster: get_all_records turns "0501..." into
+# the number 501..., so leading zeros are dropped before comparing
+def normalize_ids(ids):
+    return ids.astype(str).str.strip().str.lstrip("0").replace("", "0")
+
+
+# Undo normalize_ids for IDs read back from the sheet by restoring leading zeros
+def restore_ids(ids):
+    return ids.astype(str).str.strip().str.zfill(ID_LENGTH)
@@ -0,0 +1,75 @@
+# table.py
+
+from functools import partial
+
+import numpy as np
+import pyarrow as pa
+import streamlit as st
+
+from utils import data
+from utils.tracing import span
+
+# Number of records per page unless a page asks for something else
+DEFAULT_PAGE_SIZE = 20
+
+
+def _to_arrow(frame):
+    with span("table.to_arrow"):
+        try:
+            return pa.Table.from_pandas(frame, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Columns mixing numbers and text are shown as text, like st.dataframe does
+            mixed = {column: str for column in frame.columns if frame[column].dtype == object}
+            return pa.Table.from_pandas(frame.astype(mixed), preserve_index=False)
+
+
+# Arrow copy of a roster version, built once and shared by every session of its
+# school; it is kept in that school's cache and counts toward its memory budget.
+# Windows are cut from it with take(), so only the visible rows are serialized.
+def arrow_table(version, frame):
+    return data.derive(version, "arrow_table", partial(_to_arrow, frame))
+
+
+# Show one page of a large table without sending the rest to the browser.
+# rows are the positions to show, in display order (all rows by default).
+# With a sorter(column, descending) -> positions the table offers server-side
+# sorting; the engine from utils.filters provides one.
+def render_table(key, frame, version, rows=None, page_size=DEFAULT_PAGE_SIZE, sorter=None):
+    if rows is None:
+        rows = np.arange(len(frame))
+
+    if sorter is not None:
+        col1, col2 = st.columns(2)
+        with col1:
+            sort_column = st.selectbox("Sort By", ['None'] + frame.columns.tolist(), key=f"{key}_sort_column")
+        with col2:
+            sort_order = st.radio("Order", ("Ascending", "Descending"), horizontal=True, key=f"{key}_sort_order")
+        if sort_column != 'None':
+            # Keep only the requested rows, in the sorter's order
+            order = sorter(sort_column, sort_order == "Descending")
+            wanted = np.zeros(len(frame), dtype=bool)
+            wanted[rows] = True
+            rows = order[wanted[order]]
+
+    # Calculate total number of pages
+    total_records = len(rows)
+    total_pages = max(1, -(-total_records // page_size))
+
+    # Create a number input for page selection
+    page_number = st.number_input(
+        "Select Page Number", min_value=1, max_value=total_pages, value=1, step=1, key=f"{key}_page"
+    )
+
+    # Calculate the starting and ending indices of the records to display
+    start_idx = (page_number - 1) * page_size
+    end_idx = min(start_idx + page_size, total_records)
+
+    if total_records == 0:
+        st.warning("No data available to display.")
+        return
+
+    # Display the records for the current page
+    st.write(f"Displaying records {start_idx + 1} to {end_idx} of {total_records}")
+    with span(f"table.render {key}"):
+        window = arrow_table(version, frame).take(pa.array(rows[start_idx:end_idx], type=pa.int64()))
+        st.dataframe(window, hide_index=True)
@@ -0,0 +1,63 @@
+# tenants.py
+
+import streamlit as st
+
+from utils.config import get_setting
+from utils.sheets import SPREADSHEET_NAME
+
+# The school served when no [tenants] are configured
+DEFAULT_TENANT = "HGH"
+
+# Memory a school's cached worksheets may use before older ones are dropped
+DEFAULT_MEMORY_MB = 64
+
+MB = 1024 * 1024
+
+
+# One school. Its worksheets are Students_<code> and Users_<code>, in the shared
+# spreadsheet unless it has a spreadsheet of its own.
+class Tenant:
+
+    def __init__(self, code, name=None, spreadsheet=SPREADSHEET_NAME, memory_mb=DEFAULT_MEMORY_MB):
+        self.code = code
+        self.name = name or code
+        self.spreadsheet = spreadsheet
+        self.students_sheet = f"Students_{code}"
+        self.users_sheet = f"Users_{code}"
+        self.memory_budget = int(float(memory_mb) * MB)
+
+
+# Schools from the [tenants] secrets, keyed by code, e.g.
+#   [tenants.HGH]
+#   name = "Hoërskool HGH"
+#   [tenants.WBH]
+#   name = "Hoërskool WBH"
+#   spreadsheet = "Entry_Form_WBH"
+#   memory_mb = 128
+@st.cache_resource
+def get_tenants():
+    configured = get_setting("tenants", {}) or {}
+    if not configured:
+        return {DEFAULT_TENANT: Tenant(DEFAULT_TENANT)}
+    return {
+        code: Tenant(
+            code,
+            config.get("name"),
+            config.get("spreadsheet", SPREADSHEET_NAME),
+            config.get("memory_mb", DEFAULT_MEMORY_MB),
+        )
+        for code, config in configured.items()
+    }
+
+
+def default_code():
+    return next(iter(get_tenants()))
+
+
+# The tenant for a code, or the first configured one for None
+def get_tenant(code=None):
+    tenants = get_tenants()
+    code = code or default_code()
+    if code not in tenants:
+        raise ValueError(f"Unknown school: {code}")
+    return tenants[code]
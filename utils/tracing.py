@@ -0,0 +1,209 @@
+# tracing.py
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+from utils.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# Settings live in a [tracing] section of the secrets, e.g.
+#   [tracing]
+#   admins = ["admin"]
+#   log_path = ".cache/traces.jsonl"
+#   read_quota = 60
+#   write_quota = 60
+# An empty log_path turns the log off; only the listed admins see the panel.
+DEFAULT_LOG_PATH = ".cache/traces.jsonl"
+
+# Sheets API limits per user and minute; the service account is that user
+DEFAULT_QUOTA = {"read": 60, "write": 60}
+
+# Warn once calls in the last minute reach this share of the quota
+WARN_RATIO = 0.8
+
+# The trace of the page run on the current script thread
+_local = threading.local()
+
+_log_lock = threading.Lock()
+
+
+def _settings():
+    return get_setting("tracing", {}) or {}
+
+
+# Timed spans and Sheets calls of one page run
+class Trace:
+
+    def __init__(self, page):
+        self.page = page
+        self.started = time.time()
+        self.calls = {"read": 0, "write": 0}
+        self.spans = []
+        self._start = time.perf_counter()
+        self._depth = 0
+
+    def elapsed_ms(self, since=None):
+        return round((time.perf_counter() - (since or self._start)) * 1000, 2)
+
+    def to_dict(self):
+        return {
+            "page": self.page,
+            "started": self.started,
+            "total_ms": self.elapsed_ms(),
+            "calls": dict(self.calls),
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }
+
+
+# Sheets API calls of the whole process over a sliding one-minute window
+class ApiMeter:
+
+    def __init__(self, quota):
+        self.quota = quota
+        self._lock = threading.Lock()
+        self._calls = {kind: deque() for kind in quota}
+        self.totals = {kind: 0 for kind in quota}
+
+    def _prune(self, kind, now):
+        calls = self._calls[kind]
+        while calls and now - calls[0] >= 60:
+            calls.popleft()
+
+    def record(self, kind, count=1):
+        now = time.monotonic()
+        with self._lock:
+            before = len(self._calls[kind])
+            self._prune(kind, now)
+            self._calls[kind].extend([now] * count)
+            self.totals[kind] += count
+            used = len(self._calls[kind])
+        threshold = math.ceil(self.quota[kind] * WARN_RATIO)
+        if before < threshold <= used:
+            logger.warning("Sheets %s calls at %d of %d in the last minute", kind, used, self.quota[kind])
+
+    # {kind: calls in the last 60 seconds}
+    def last_minute(self):
+        now = time.monotonic()
+        with self._lock:
+            for kind in self._calls:
+                self._prune(kind, now)
+            return {kind: len(calls) for kind, calls in self._calls.items()}
+
+
+@st.cache_resource
+def get_meter():
+    settings = _settings()
+    return ApiMeter({kind: int(settings.get(f"{kind}_quota", limit)) for kind, limit in DEFAULT_QUOTA.items()})
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+# Time a stage of the current page run. Outside a page run (e.g. on the
+# replica's sync thread) nothing is recorded.
+@contextmanager
+def span(name):
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    trace._depth += 1
+    try:
+        yield
+    finally:
+        trace._depth -= 1
+        trace.spans.append({
+            "name": name,
+            "start_ms": round((start - trace._start) * 1000, 2),
+            "ms": trace.elapsed_ms(start),
+            "depth": trace._depth,
+        })
+
+
+# A Sheets API request: counted against the quota and timed as a span.
+# count is the number of API requests the gspread call makes.
+@contextmanager
+def sheets_call(kind, name, count=1):
+    get_meter().record(kind, count)
+    for trace in [current_trace(), *getattr(_local, "shared", ())]:
+        if trace is not None:
+            trace.calls[kind] += count
+    with span(f"sheets.{name}"):
+        yield
+
+
+# Run a block on a worker thread (e.g. the write queue's) on behalf of the page
+# runs with these traces (None entries are skipped). Spans go to the first one;
+# Sheets calls, which one batched request may make for several runs, are
+# counted in each.
+@contextmanager
+def use_traces(traces):
+    traces = [trace for trace in traces if trace is not None]
+    previous = current_trace(), getattr(_local, "shared", ())
+    _local.trace = traces[0] if traces else None
+    _local.shared = traces[1:]
+    try:
+        yield
+    finally:
+        _local.trace, _local.shared = previous
+
+
+# Begin tracing a page run on this script thread
+def start_page(page):
+    _local.trace = Trace(page)
+
+
+def _write_log(record):
+    path = _settings().get("log_path", DEFAULT_LOG_PATH)
+    if not path:
+        return
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
+    except OSError:
+        logger.exception("Could not write trace log %s", path)
+
+
+def _show_panel(record, quota):
+    with st.sidebar.expander("Performance", expanded=False):
+        st.write(f"**{record['page']}** rerun: {record['total_ms']:.0f} ms")
+        if record["spans"]:
+            spans = pd.DataFrame(record["spans"])
+            spans["name"] = ["· " * depth + name for depth, name in zip(spans["depth"], spans["name"])]
+            st.dataframe(spans[["name", "start_ms", "ms"]], hide_index=True)
+        st.write(f"Sheets calls this run: {record['calls']['read']} read, {record['calls']['write']} write")
+        for kind, used in record["last_minute"].items():
+            st.progress(min(used / quota[kind], 1.0), text=f"{kind.title()} calls in the last minute: {used} / {quota[kind]}")
+            if used >= quota[kind] * WARN_RATIO:
+                st.warning(f"Close to the Sheets {kind} quota; further calls may be rejected with 429.")
+
+
+# End the page run: append it to the JSON-lines log and, for admins, show the
+# sidebar panel
+def finish_page(username=None):
+    trace = current_trace()
+    if trace is None:
+        return
+    _local.trace = None
+
+    meter = get_meter()
+    record = trace.to_dict()
+    record["last_minute"] = meter.last_minute()
+    _write_log(record)
+
+    if username and username in _settings().get("admins", []):
+        _show_panel(record, meter.quota)
@@ -0,0 +1,235 @@
+# writes.py
+
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import streamlit as st
+
+from utils.config import get_setting
+from utils.sheets import SPREADSHEET_NAME
+from utils.storage import get_storage
+from utils.tracing import current_trace, use_traces
+
+logger = logging.getLogger(__name__)
+
+# Settings live in a [writes] section of the secrets, e.g.
+#   [writes]
+#   per_minute = 60
+#   burst = 10
+#   read_per_minute = 60
+#   read_burst = 10
+#   batch_window = 0.05
+#   max_retries = 5
+# The read limits apply to the lookups writes make before they go out.
+DEFAULT_PER_MINUTE = 60
+DEFAULT_BURST = 10
+
+# How long the writer waits for more writes to join a batch, in seconds
+DEFAULT_BATCH_WINDOW = 0.05
+
+# Retries of a rate-limited call, waiting 1, 2, 4, ... seconds (plus jitter)
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 32.0
+
+
+# Raised when a row changed (or a key appeared) after the session read it, so
+# writing would overwrite someone else's work
+class WriteConflict(Exception):
+    pass
+
+
+# One pending change to a worksheet. kind is "update", "append" or "delete";
+# keys are the student IDs it touches. The writer calls, in its own thread and
+# in queue order:
+#   check()         raise WriteConflict if the change is no longer safe
+#   prepare()       the storage payload: {row: {column number: value}} for an
+#                   update, a list of rows for an append, a row for a delete;
+#                   None if the target is gone (the write then resolves to False)
+#   apply(result)   bring the local copies up to date once the write landed; gets
+#                   the payload, or the first row number for an append
+# Sheets calls made for it are counted in the trace of the page run that queued it.
+class WriteOp:
+
+    def __init__(self, kind, keys, prepare, apply, check=None):
+        self.kind = kind
+        self.keys = set(keys)
+        self.prepare = prepare
+        self.apply = apply
+        self.check = check
+        self.trace = current_trace()
+        self.future = Future()
+
+
+# Allows rate calls a second on average with bursts of up to capacity calls
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Process-wide queue of worksheet writes. One thread drains it, merging runs of
+# updates from every session into one update_rows call and runs of appends into
+# one append call. Deletes go one at a time since they move the rows below.
+class WriteQueue:
+
+    def __init__(self, storage, name, bucket, batch_window=DEFAULT_BATCH_WINDOW, max_retries=DEFAULT_MAX_RETRIES, read_bucket=None):
+        self.storage = storage
+        self.name = name
+        self.bucket = bucket
+        self.read_bucket = read_bucket or bucket
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name=f"writes-{name}", daemon=True).start()
+
+    # Queue a write and return its Future
+    def submit(self, op):
+        self._queue.put(op)
+        return op.future
+
+    def _run(self):
+        while True:
+            ops = [self._queue.get()]
+            time.sleep(self.batch_window)
+            while True:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for group in self._groups(ops):
+                try:
+                    self._write(group)
+                except Exception as error:
+                    logger.exception("Write to %s failed", self.name)
+                    for op in group:
+                        if not op.future.done():
+                            op.future.set_exception(error)
+
+    # Consecutive writes of the same kind, split where a student repeats so
+    # each check sees the result of the write before it
+    def _groups(self, ops):
+        group, keys = [], set()
+        for op in ops:
+            if group and (op.kind != group[0].kind or op.kind == "delete" or op.keys & keys):
+                yield group
+                group, keys = [], set()
+            group.append(op)
+            keys |= op.keys
+        if group:
+            yield group
+
+    # Call the storage, retrying with exponential backoff while it is rate limited
+    def _call(self, func, *args, bucket=None):
+        for attempt in range(self.max_retries + 1):
+            (bucket or self.bucket).take()
+            try:
+                return func(self.name, *args)
+            except Exception as error:
+                if attempt == self.max_retries or not self.storage.is_quota_error(error):
+                    raise
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) + random.uniform(0, BACKOFF_BASE)
+                logger.warning("Rate limited on %s, retrying in %.1f s", self.name, delay)
+                time.sleep(delay)
+
+    # Read from the storage on the writer thread (e.g. from prepare), limited and
+    # retried like the writes themselves
+    def read(self, func, *args):
+        return self._call(func, *args, bucket=self.read_bucket)
+
+    def _write(self, group):
+        ready = []
+        for op in group:
+            try:
+                with use_traces([op.trace]):
+                    if op.check is not None:
+                        op.check()
+                    payload = op.prepare()
+            except Exception as error:
+                op.future.set_exception(error)
+                continue
+            if payload is None:
+                op.future.set_result(False)
+            else:
+                ready.append((op, payload))
+        if not ready:
+            return
+
+        kind = group[0].kind
+        with use_traces([op.trace for op, _ in ready]):
+            results = self._send(kind, ready)
+
+        for (op, _), result in zip(ready, results):
+            try:
+                with use_traces([op.trace]):
+                    op.future.set_result(op.apply(result))
+            except Exception as error:
+                logger.exception("Updating local copies after a write to %s failed", self.name)
+                op.future.set_exception(error)
+
+    # One storage call for the prepared writes of a group; returns what each op's apply gets
+    def _send(self, kind, ready):
+        if kind == "update":
+            merged = {}
+            for _, payload in ready:
+                for row, values in payload.items():
+                    merged.setdefault(row, {}).update(values)
+            self._call(self.storage.update_rows, merged)
+            results = [payload for _, payload in ready]
+        elif kind == "append":
+            first_row = self._call(self.storage.append, [row for _, payload in ready for row in payload])
+            results = []
+            for _, payload in ready:
+                results.append(first_row)
+                first_row += len(payload)
+        else:
+            (_, row), = ready
+            self._call(self.storage.delete_row, row)
+            results = [row]
+        return results
+
+
+# Every school's writes go out under the same service account and so share
+# its quota: one bucket per kind ("write" or "read") for the whole process
+@st.cache_resource
+def get_rate_limiter(kind="write"):
+    config = get_setting("writes", {})
+    prefix = "read_" if kind == "read" else ""
+    return TokenBucket(
+        float(config.get(prefix + "per_minute", DEFAULT_PER_MINUTE)) / 60,
+        float(config.get(prefix + "burst", DEFAULT_BURST)),
+    )
+
+
+# One queue (and writer thread) per worksheet
+@st.cache_resource
+def get_write_queue(name, spreadsheet=SPREADSHEET_NAME):
+    config = get_setting("writes", {})
+    return WriteQueue(
+        get_storage(spreadsheet),
+        name,
+        get_rate_limiter(),
+        float(config.get("batch_window", DEFAULT_BATCH_WINDOW)),
+        int(config.get("max_retries", DEFAULT_MAX_RETRIES)),
+        get_rate_limiter("read"),
+    )